@@ -0,0 +1,4 @@
+'''Reference implementations and equivalence and performance checks of the pipeline scripts.
+
+Each module is run from NLP_Network_Analysis_Python, e.g. python -m benchmarks.s1_tweet_cleaner
+'''
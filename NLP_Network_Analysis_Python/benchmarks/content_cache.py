@@ -0,0 +1,52 @@
+# %%
+import tempfile
+
+from content_cache import ContentCache, content_key
+
+
+class UpperCache(ContentCache):
+    '''Stand-in for the cleaning and preprocessing caches: the upper case text and its length.'''
+
+    def __init__(self, path=None, max_size=None, version='upper_v1'):
+        super().__init__(version, ['upper', 'length'], path, max_size)
+        self.computed = []
+
+    def compute(self, texts):
+        self.computed += texts
+        return [(text.upper(), len(text)) for text in texts]
+
+
+# %%
+# Keys: one per text and version, also for versions longer than blake2b's 16-byte person parameter
+assert len(content_key('', 'preprocess_tweet_for_bert_v1')) == 32
+assert content_key('a', 'v1') != content_key('b', 'v1') and content_key('a', 'v1') != content_key('a', 'v2')
+
+# Each distinct text is computed once, missing texts are computed as 'nan' and 'None' (as str(text) gives them)
+cache = UpperCache()
+assert cache.apply(['a', float('nan'), 'a', None, 'b']).tolist() == [('A', 1), ('NAN', 3), ('A', 1), ('NONE', 4), ('B', 1)]
+assert cache.apply(['b', 'c']).tolist() == [('B', 1), ('C', 1)]
+assert cache.computed == ['a', 'nan', 'None', 'b', 'c']
+assert (cache.rows, cache.hits, cache.misses) == (7, 1, 5)
+
+# The least recently used entries are evicted first
+cache = UpperCache(max_size=2)
+cache.apply(['a', 'b'])
+cache.apply(['a', 'c'])
+cache.apply(['a', 'b'])
+assert cache.computed == ['a', 'b', 'c', 'b']
+
+# Saved entries are read back, and not used with another version
+with tempfile.TemporaryDirectory() as directory:
+    path = directory + '/cache.feather'
+    cache = UpperCache(path)
+    cache.apply(['a', 'b'])
+    cache.save()
+
+    reloaded = UpperCache(path)
+    assert reloaded.apply(['b', 'a']).tolist() == [('B', 1), ('A', 1)] and reloaded.computed == []
+    assert UpperCache(path, version='upper_v2').apply(['a']).tolist() == [('A', 1)]
+
+print('ContentCache checks passed')
+
+
+# %%
@@ -0,0 +1,44 @@
+# %%
+import numpy as np
+import tempfile
+
+from embedding_store import EmbeddingStore
+
+
+def fake_encode(texts):
+    '''Deterministic stand-in for a sentence model: the length and the character sum of each text.'''
+    return np.array([[len(text), sum(map(ord, text))] for text in texts], dtype=np.float32)
+
+
+# %%
+# Encode into a fresh store, read the same texts back from it, and compact it
+with tempfile.TemporaryDirectory() as directory:
+    store = EmbeddingStore(directory, 'fake-model')
+    texts = ['a tweet', 'another tweet', 'a tweet', '']
+
+    encoded = store.encode(texts, fake_encode)
+    assert np.array_equal(encoded, fake_encode(texts))
+    assert (len(store), store.misses, store.hits) == (3, 3, 0)
+
+    assert np.array_equal(store.encode(texts[::-1], fake_encode), fake_encode(texts[::-1]))
+    assert (len(store), store.misses, store.hits) == (3, 3, 3)
+
+    # Two processes that opened the store at the same time both append a new text, a third reads it from its first row
+    first, second = EmbeddingStore(directory, 'fake-model'), EmbeddingStore(directory, 'fake-model')
+    first.encode(['a new tweet'], fake_encode)
+    second.encode(['a new tweet'], lambda texts: fake_encode(texts) + 1)
+    reopened = EmbeddingStore(directory, 'fake-model')
+    assert len(reopened) == 5
+    assert np.array_equal(reopened.encode(['a tweet', 'a new tweet'], fake_encode), fake_encode(['a tweet', 'a new tweet']))
+
+    reopened.compact(keep_texts=['a new tweet'])
+    assert len(reopened) == 1 and len(reopened.segments) == 1
+    assert np.array_equal(reopened.encode(['a new tweet'], fake_encode), fake_encode(['a new tweet']))
+
+    # An empty call into a fresh store
+    assert EmbeddingStore(directory, 'other-model').encode([], fake_encode).shape[0] == 0
+
+print('EmbeddingStore checks passed')
+
+
+# %%
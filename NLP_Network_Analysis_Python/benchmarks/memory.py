@@ -0,0 +1,21 @@
+import multiprocessing
+import resource
+
+
+def peak_rss(func, *args):
+    '''Runs func(*args) in a forked child process and returns by how many MB its peak resident memory rose above the start.
+
+    NOTE: Measured in a child process, so the peaks of earlier measurements (and of this process) do not hide the peak of func.
+    '''
+    def target(conn):
+        start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        func(*args)
+        conn.send((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start) / 1024)  # NOTE: ru_maxrss is in KB on Linux
+
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=target, args=(child_conn,))
+    process.start()
+    peak = parent_conn.recv()
+    process.join()
+    return peak
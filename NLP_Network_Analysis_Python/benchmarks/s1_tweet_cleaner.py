@@ -0,0 +1,170 @@
+# %%
+import html
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import regex
+import time
+
+import contractions
+from textacy import preprocessing
+
+from benchmarks.memory import peak_rss
+from tweet_cleaning import clean_text, clean_texts, clean_texts_parallel, clean_texts_with_mentions
+from tweet_loading import RAW_COLUMNS, TRANSLATED_COLUMNS, load_translated_tweets, parse_referenced_tweets, read_tweets
+
+DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  # NOTE: Same as in s1_tweet_cleaner.py
+
+
+# %%
+# Reference implementations
+def clean_text_reference(text):
+    '''Original cleaning pipeline. Kept as the reference clean_text is checked against.'''
+    text = str(text)
+    text = html.unescape(text)  # Replaces HTML characters
+    text = re.sub('VIDEO:|AUDIO:', ' ', text)  # Removes specific tags like 'VIDEO:'
+    text = re.sub(r'http\S+|www.\S+|bit.ly/\S+|pic.twitter\S+', ' ', text)  # Removes URLs
+    text = preprocessing.normalize.quotation_marks(text)
+    text = text.encode('ascii', 'ignore').decode()  # Removes non ASCII characters
+    text = re.sub(r'\s+', ' ', text).strip()  # Removes unicode whitespace characters
+    text = re.sub(r'\\r|\\n|\\t|\\f|\\v', ' ', text)  # For messy data, removes unicode whitespace characters
+    text = re.sub(r'(^|[^@\w])@(\w{1,15})\b', ' ', text)  # Replaces twitter handles and emails
+    text = preprocessing.replace.emails(text, repl=' ')
+    text = re.sub(r'\$\w*', ' ', text)  # Removes tickers
+    text = preprocessing.remove.accents(text)
+    text = text.replace('-', ' ').replace('–', ' ')  # Replaces dashes and special characters
+    text = preprocessing.normalize.unicode(text)
+    text = regex.compile('[ha][ha]+ah[ha]+').sub('haha', text)
+    text = text.replace('&', ' and ')
+    text = re.sub(r'([A-Za-z])\1{2,}', r'\1', text)  # Removes repeated characters
+    text = re.sub(r'\b([a-zA-Z]{1,3})(\.[a-zA-Z]{1,3}\.?)+\b', lambda match: match.group(0).replace('.', ''), text)  # Handles abbreviations with multiple dots
+    text = contractions.fix(text, slang=True)
+    text = regex.compile(r'(?:(?=\b(?:\p{Lu} +){2}\p{Lu})|\G(?!\A))\p{Lu}\K +(?=\p{Lu}(?!\p{L}))').sub('', text)  # Replaces kerned
+    text = text.lower()
+    text = re.sub(r'[^a-zA-Z]+', ' ', text)  # Removes numbers, special characters, etc.
+    text = preprocessing.normalize.whitespace(text)  # Normalises whitespace
+    return text
+
+
+def extract_info(lst):
+    '''Extracts information from a list of dictionaries and concatenates the values.'''
+    if not isinstance(lst, list):  # Tweets without 'referenced_tweets'
+        return ''
+    values = [list(d.values()) for d in lst if isinstance(d, dict)]
+    return ','.join(str(value) for sublist in values for value in sublist)
+
+
+def load_tweets_json(path):
+    '''Original loader: parses the whole JSON file into memory before keeping the RAW_COLUMNS.'''
+    with open(path, 'r') as file:
+        data = json.load(file)
+    df = pd.DataFrame(data)
+    return df[RAW_COLUMNS]
+
+
+def load_translated_tweets_reference(path):
+    '''Original loader: reads all columns before keeping the TRANSLATED_COLUMNS and converts the IDs to str.'''
+    df = pd.read_feather(path)
+    df = df[TRANSLATED_COLUMNS]
+    df['id'] = df['id'].astype(str)
+    return df
+
+
+def split_referenced_tweets(df):
+    '''Original parser: flattens 'referenced_tweets' into a string and splits it into 'action' and 'action_id'.'''
+    df['referenced_tweets'] = df['referenced_tweets'].apply(extract_info)
+
+    # NOTE: reindex keeps 'action_id' in chunks where no tweet references another one
+    split_values = df['referenced_tweets'].str.split(',', n=1, expand=True).reindex(columns=[0, 1])
+
+    df['action'] = split_values[0]
+    df['action_id'] = split_values[1]
+    return df
+
+
+# %%
+# Compare the peak memory of streaming the raw tweets with loading the whole JSON file
+def stream_tweets(path):
+    return pd.concat(read_tweets(path), ignore_index=True)
+
+
+for name, func in [('json.load', load_tweets_json), ('streaming', stream_tweets)]:
+    print(f'{name}: peak RSS +{peak_rss(func, DATA_PATH + "bigsss_tweets.json"):,.0f} MB')
+
+# Compare the string round trip with the columnar parser for 'referenced_tweets'
+raw_sample = next(read_tweets(DATA_PATH + 'bigsss_tweets.json'))
+
+for name, func in [('extract_info + str.split', split_referenced_tweets), ('columnar', parse_referenced_tweets)]:
+    start = time.perf_counter()
+    parsed = func(raw_sample.copy())
+    print(f'{name}: {len(raw_sample) / (time.perf_counter() - start):,.0f} tweets/sec')
+
+# Both agree on the action of every tweet
+assert (split_referenced_tweets(raw_sample.copy())['action'].replace('', np.nan).fillna('') == parsed['action'].astype(object).fillna('')).all()
+
+
+# %%
+# Compare peak and steady-state memory of loading the translated tweets
+for name, func in [('full read + str IDs', load_translated_tweets_reference), ('projected + categorical', load_translated_tweets)]:
+    peak = peak_rss(func, DATA_PATH + 'bigsss_tweets_translated.feather')
+    steady = func(DATA_PATH + 'bigsss_tweets_translated.feather').memory_usage(deep=True).sum() / 1024 ** 2
+    print(f'{name}: peak RSS +{peak:,.0f} MB, data frame {steady:,.0f} MB')
+
+
+# %%
+# Check clean_text against the reference implementation and benchmark both
+translated_texts = load_translated_tweets(DATA_PATH + 'bigsss_tweets_translated.feather')['text_translated']
+
+check_corpus = [
+    'VIDEO: Watch my speech https://t.co/abc123 &amp; share!!!',
+    'RT @ursula_vdl: We stand with #Ukraine – today &amp; tomorrow.',
+    'Contact me at someone@example.com or @MEP_office about $TSLA',
+    'Hahahaha that is sooooo funny haaahaha',
+    'The U.S.A. and the E.U. agreed on sanctions, i.e. a ban.',
+    'T H I S is kerned, S O is T H I S',
+    'I can\'t believe we\'re gonna do this, y\'all',
+    '“Quoted” text with ‘single’ quotes — and accents: café, naïve',
+    'Messy\\ndata\\twith\\rescaped whitespace \\v and \\f',
+    '  Leading   and\ttrailing\nwhitespace  ',
+    'pic.twitter.com/xyz www.europarl.europa.eu bit.ly/3abc',
+    'Numbers 2022 and symbols %^*() -- should go',
+    'Слава Україні! Glory to Ukraine!',
+    'email.like@handle.eu vs @handle_with_more_than_fifteen_chars',
+    '',
+    None,
+    float('nan'),
+]
+check_corpus += translated_texts.sample(n=min(10_000, len(translated_texts)), random_state=42).tolist()
+
+expected = [clean_text_reference(text) for text in check_corpus]
+mismatches = [(text, exp, got) for text, exp, got in zip(check_corpus, expected, clean_texts(check_corpus)) if exp != got]
+assert not mismatches, f'clean_text differs from clean_text_reference on {len(mismatches)} tweets, e.g. {mismatches[:3]}'
+
+# Keeping the mentions does not change the clean texts
+assert [text for text, _ in clean_texts_with_mentions(check_corpus)] == expected
+print('Mentions:', clean_texts_with_mentions(check_corpus[:4]))
+
+for name, func in [('clean_text_reference', clean_text_reference), ('clean_text', clean_text)]:
+    start = time.perf_counter()
+    for text in check_corpus:
+        func(text)
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {len(check_corpus) / elapsed:,.0f} tweets/sec')
+
+# Scaling of the parallel mode with the number of workers
+scaling_sample = translated_texts.head(200_000).tolist()
+serial = clean_texts(scaling_sample)
+
+n_workers = 1
+while n_workers <= os.cpu_count():
+    start = time.perf_counter()
+    cleaned = clean_texts_parallel(scaling_sample, n_workers=n_workers)
+    elapsed = time.perf_counter() - start
+    assert cleaned == serial, f'Parallel cleaning with {n_workers} workers differs from the serial run'
+    print(f'{n_workers} worker(s): {len(scaling_sample) / elapsed:,.0f} tweets/sec')
+    n_workers *= 2
+
+
+# %%
@@ -0,0 +1,136 @@
+# %%
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import time
+
+from network_edges import as_ns, create_nodes, retweet_edges, retweet_stream, sliding_windows, window_bounds, window_membership
+from temporal_network import TemporalNetwork
+from weighted_graph import WeightedGraph
+
+DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  # NOTE: Same as in s3_network_analysis.py
+RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/'
+
+TEMPORAL_WINDOW_DAYS = 7
+TEMPORAL_STEP_DAYS = 1
+
+start_date_all_periods = '2021-10-13'
+end_date_all_periods = '2022-07-22'
+
+WINDOWS = [
+    ('period_1', '2021-10-13', '2022-02-23', RESULTS_PATH + 'period_1/'),
+    ('period_2', '2022-02-24', '2022-07-22', RESULTS_PATH + 'period_2/'),
+    ('all_periods', start_date_all_periods, end_date_all_periods, RESULTS_PATH + 'all_periods/'),
+]
+
+
+# %%
+# Reference implementation
+def retweet_edges_reference(df, start, end):
+    '''Retweet edges of one period, selected before the join (the original pipeline, used to check retweet_edges).'''
+    period = df[(df['created_at'] >= start) & (df['created_at'] <= end)]
+    retweets = period[period['action'] == 'retweeted'].copy()
+    retweets['action_id'] = retweets['action_id'].astype('int64')
+    merged = pd.merge(retweets, period, left_on='action_id', right_on='id', suffixes=('_retweet', '_original'))
+    edges = merged[['user_id_retweet', 'user_id_original']].rename(columns={'user_id_retweet': 'source', 'user_id_original': 'target'})
+    return edges[edges['source'] != edges['target']]
+
+
+def temporal_network(stream):
+    return TemporalNetwork(stream['user_id_retweet'], stream['user_id_original'],
+                           first=np.minimum(as_ns(stream['created_at_retweet']), as_ns(stream['created_at_original'])),
+                           last=np.maximum(as_ns(stream['created_at_retweet']), as_ns(stream['created_at_original'])))
+
+
+# %%
+# Window membership of time-zone aware timestamps (as s2 parses 'created_at') and of naive ones, both dates included
+for tz in ['UTC', 'Europe/Brussels', None]:
+    created_at = pd.Series(pd.to_datetime(['2021-10-12 23:59:59', '2021-10-13 00:00:00', '2022-07-21 12:00:00', '2022-07-22 00:00:00', '2022-07-22 00:00:01']))
+    if tz is not None:
+        created_at = created_at.dt.tz_localize(tz)
+    membership = window_membership(created_at, WINDOWS)
+    assert membership[:, 2].tolist() == [False, True, True, True, False], tz
+    assert membership[:, 2].tolist() == ((created_at >= start_date_all_periods) & (created_at <= end_date_all_periods)).tolist(), tz
+
+
+# %%
+# Load data
+df = pd.read_feather(DATA_PATH + 'bigsss_tweets_w_topic.feather')
+df_rus_ukr = df.loc[(df['russo_ukraine']==1)]
+
+
+# %%
+# Compare with joining the retweets of each window separately
+start = time.perf_counter()
+edges_reference = {name: retweet_edges_reference(df_rus_ukr, window_start, window_end) for name, window_start, window_end, _ in WINDOWS}
+print(f'Per-window joins: {time.perf_counter() - start:,.2f} s for {len(WINDOWS)} windows')
+
+start = time.perf_counter()
+edges = retweet_edges(df_rus_ukr, WINDOWS)
+print(f'Single join: {time.perf_counter() - start:,.2f} s for {len(WINDOWS)} windows')
+
+for name in edges:
+    assert edges[name].reset_index(drop=True).equals(edges_reference[name].reset_index(drop=True)), name
+
+# The cost of more windows, e.g. weekly sliding windows over the whole span
+weekly = sliding_windows(start_date_all_periods, end_date_all_periods, length=7, step=7, path=RESULTS_PATH)
+start = time.perf_counter()
+retweet_edges(df_rus_ukr, weekly)
+print(f'Single join: {time.perf_counter() - start:,.2f} s for {len(weekly)} weekly windows')
+
+
+# %%
+# Compare the temporal network with building the graph of every window from scratch
+stream = retweet_stream(df_rus_ukr)
+temporal_windows = sliding_windows(start_date_all_periods, end_date_all_periods, length=TEMPORAL_WINDOW_DAYS, step=TEMPORAL_STEP_DAYS, path=RESULTS_PATH)
+starts, ends = window_bounds(temporal_windows, stream['created_at_retweet'].dt.tz)
+
+start = time.perf_counter()
+rebuilt = [WeightedGraph.from_edges(window_edges) for window_edges in retweet_edges(df_rus_ukr, temporal_windows).values()]
+print(f'Rebuilding each window: {time.perf_counter() - start:,.2f} s for {len(temporal_windows)} windows')
+
+start = time.perf_counter()
+network = temporal_network(stream)
+incremental = [(window.number_of_nodes, window.number_of_edges, window.total_weight) for window in network.run(starts, ends)]
+print(f'Incremental: {time.perf_counter() - start:,.2f} s for {len(temporal_windows)} windows')
+
+assert incremental == [(graph.number_of_nodes(), graph.number_of_edges(), int(graph.adjacency.sum())) for graph in rebuilt]
+
+
+# %%
+# Compare writing, reading and the size of the graph files with the CSV pair
+# NOTE: Written to a temporary directory, so that the files of s3 are left as they are
+for name in edges:
+    nodes = create_nodes(edges[name])
+    graph = WeightedGraph.from_edges(edges[name], nodes['label'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = directory + '/'
+
+        start = time.perf_counter()
+        edges[name].to_csv(path + 'edges.csv', index=False)
+        nodes.to_csv(path + 'nodes.csv', index=False)
+        csv_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pd.read_csv(path + 'edges.csv')
+        pd.read_csv(path + 'nodes.csv')
+        csv_read = time.perf_counter() - start
+        csv_size = os.path.getsize(path + 'edges.csv') + os.path.getsize(path + 'nodes.csv')
+
+        start = time.perf_counter()
+        graph.save(path)
+        graph_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        WeightedGraph.load(path)
+        graph_read = time.perf_counter() - start
+        graph_size = os.path.getsize(path + 'retweet_graph.npz') + os.path.getsize(path + 'retweet_nodes.feather')
+
+    print(f'{name}: {len(edges[name]):,} retweets, {graph.number_of_edges():,} weighted edges, {graph.number_of_nodes():,} nodes')
+    print(f'  CSV pair: {csv_size / 1e6:,.2f} MB, write {csv_write:,.3f} s, read {csv_read:,.3f} s')
+    print(f'  Graph:    {graph_size / 1e6:,.2f} MB, write {graph_write:,.3f} s, read {graph_read:,.3f} s')
+
+
+# %%
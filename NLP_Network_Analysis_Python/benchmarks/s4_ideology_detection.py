@@ -0,0 +1,200 @@
+# %%
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+
+sys.path.insert(1, '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine') # adjust if necessary
+
+from benchmarks.memory import peak_rss
+from bert_preprocessing import PreprocessCache, preprocess_texts, preprocess_texts_parallel
+from embedding_store import EmbeddingStore
+from sentence_transformers import SentenceTransformer
+from src.tweet_preprocessing import preprocess_tweet_for_bert
+from tweet_selection import group_tweets, original_tweets, select_tweets, tweets_in_periods
+from user_embeddings import UserEmbeddings, period_embeddings
+
+from tqdm import tqdm
+
+tqdm.pandas()
+
+# NOTE: Same paths and settings as in s4_ideology_detection.py
+DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'
+RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/'
+EMBEDDINGS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/embeddings/'
+
+EMBEDDING_DTYPE = 'float32'
+ENCODE_BATCH_SIZE = 64
+MAX_TWEETS = 200
+SENTENCE_MODEL = 'all-mpnet-base-v2'
+
+PERIODS = [
+    ('period_1', '2021-10-13', '2022-02-23', RESULTS_PATH + 'period_1/'),
+    ('period_2', '2022-02-24', '2022-07-22', RESULTS_PATH + 'period_2/'),
+    ('all_periods', '2021-10-13', '2022-07-22', RESULTS_PATH + 'all_periods/'),
+]
+
+
+# %%
+# Reference implementations
+def process_period(df):
+    '''Original grouping: a list of all tweets per author, truncated to the first MAX_TWEETS.'''
+    df_grouped = df.groupby('author_id')['tweets'].apply(list).reset_index()
+    df_grouped['tweets'] = df_grouped['tweets'].apply(lambda x: np.array(x[:MAX_TWEETS]))
+    return df_grouped
+
+
+def preprocess_tweets(tweets):
+    out = []
+    for tw in tweets:
+        tw = preprocess_tweet_for_bert(tw)
+        if len(tw) > 1:
+            out.append(" ".join(tw))
+    return out
+
+
+def embed_users(user_tweets, encode):
+    '''Mean embedding of each user's tweets. The tweets of all users are encoded in one call, then averaged per user with a segment sum.'''
+    lengths = np.array([len(tweets) for tweets in user_tweets])
+    if len(lengths) == 0:
+        return []
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])  # NOTE: Position of each user's first tweet, every user has at least one
+
+    embeddings = encode([tweet for tweets in user_tweets for tweet in tweets])
+    means = np.add.reduceat(embeddings, offsets, axis=0) / lengths[:, None]
+    return list(means.astype(embeddings.dtype))
+
+
+def embed_users_reference(user_tweets, encode):
+    '''Original approach: encodes the tweets of each user in a call of its own.'''
+    return [np.mean(encode(tweets), axis=0) for tweets in user_tweets]
+
+
+def compute_embeddings(df_grouped, path):
+    '''Computes and saves the embeddings of one period on its own (loads the model and encodes the period's tweets), as the per-period pipeline did.'''
+    df_grouped["tweets"] = df_grouped["tweets"].progress_apply(preprocess_tweets)
+
+    # Remove users with no tweets
+    df_grouped = df_grouped[df_grouped["tweets"].apply(len) > 0]
+
+    model = SentenceTransformer(SENTENCE_MODEL)
+
+    # Encode the tweets of all users in one go and average them per user
+    def encode(tweets):
+        return embedding_store.encode(tweets, lambda texts: model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True))
+
+    df_grouped["embeddings"] = embed_users(df_grouped["tweets"].tolist(), encode)
+
+    embeddings_tmp = df_grouped[["author_id", "embeddings"]]
+    embeddings_tmp.reset_index(drop=True, inplace=True)
+
+    # Save embeddings to the specified path
+    embeddings_tmp.to_feather(path + "embeddings.feather")
+
+
+# %%
+# Load data, as s4 does
+df = pd.read_feather(DATA_PATH + 'bigsss_tweets_w_topic.feather')
+df_rus_ukr = original_tweets(df.loc[(df['russo_ukraine']==1)])
+period_tweets = tweets_in_periods(df_rus_ukr, PERIODS)
+period_selections = {name: select_tweets(period_tweets, start, end, MAX_TWEETS) for name, start, end, _ in PERIODS}
+
+
+# %%
+# Compare the peak memory of grouping the tweets of all periods
+def group_periods_reference():
+    return [process_period(df_rus_ukr[(df_rus_ukr['created_at'] >= start) & (df_rus_ukr['created_at'] <= end)]) for _, start, end, _ in PERIODS]
+
+
+def group_periods():
+    return [select_tweets(period_tweets, start, end, MAX_TWEETS) for _, start, end, _ in PERIODS]
+
+
+for name, func in [('groupby → list → np.array', group_periods_reference), ('sorted, capped flat tables', group_periods)]:
+    start_time = time.perf_counter()
+    peak = peak_rss(func)
+    print(f'{name}: peak RSS +{peak:,.0f} MB, {time.perf_counter() - start_time:,.1f} s')
+
+
+# %%
+# Compare the throughput of preprocessing with the number of workers
+scaling_sample = period_tweets['tweets'].head(50_000).tolist()
+serial = preprocess_texts(scaling_sample)
+
+n_workers = 1
+while n_workers <= os.cpu_count():
+    start_time = time.perf_counter()
+    parallel = preprocess_texts_parallel(scaling_sample, n_workers=n_workers)
+    assert parallel == serial, f'Parallel preprocessing with {n_workers} workers differs from the serial run'
+    print(f'{n_workers} worker(s): {len(scaling_sample) / (time.perf_counter() - start_time):,.0f} rows/sec')
+    n_workers *= 2
+
+
+# %%
+# Tweet-level embeddings, as s4 computes them (read from the embedding store where s4 already encoded the tweets)
+embedding_store = EmbeddingStore(EMBEDDINGS_PATH, SENTENCE_MODEL, dtype=EMBEDDING_DTYPE)
+model = SentenceTransformer(SENTENCE_MODEL)
+
+selected = np.unique(np.concatenate([tweets['row'].to_numpy() for tweets in period_selections.values()]))
+preprocessed = pd.Series(None, index=range(len(period_tweets)), dtype=object)
+preprocessed.iloc[selected] = PreprocessCache().preprocess(period_tweets['tweets'].iloc[selected])
+valid = preprocessed.notna().to_numpy()
+
+encoded = embedding_store.encode(preprocessed[valid].tolist(), lambda texts: model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True))
+tweet_embeddings = np.zeros((len(period_tweets), encoded.shape[1] if len(encoded) else 0), dtype=np.float32)
+tweet_embeddings[valid] = encoded
+
+
+# %%
+# Compare the throughput of encoding all tweets at once with encoding them user by user (without the embedding store)
+all_periods_grouped = group_tweets(period_selections['all_periods'])
+benchmark_users = all_periods_grouped.sample(n=min(500, len(all_periods_grouped)), random_state=42)["tweets"].apply(preprocess_tweets)
+benchmark_users = [tweets for tweets in benchmark_users if len(tweets) > 0]
+n_tweets = sum(len(tweets) for tweets in benchmark_users)
+
+results = {}
+for name, func in [('user by user', embed_users_reference), ('all at once', embed_users)]:
+    start = time.perf_counter()
+    results[name] = np.stack(func(benchmark_users, model.encode))
+    print(f'{name}: {n_tweets / (time.perf_counter() - start):,.0f} tweets/sec ({len(benchmark_users):,} users, {n_tweets:,} tweets)')
+
+# NOTE: Only padding and summation order differ, so the mean embeddings agree up to float32 precision
+print('Largest difference:', np.abs(results['user by user'] - results['all at once']).max())
+
+# Each period computed on its own, from its grouped tweets, gives the same authors and embeddings
+for name, _, _, path in PERIODS:
+    start_time = time.perf_counter()
+    compute_embeddings(group_tweets(period_selections[name]), path)
+    separate = pd.read_feather(path + "embeddings.feather")
+    print(f'{name} on its own: {time.perf_counter() - start_time:,.1f} s')
+
+    start_time = time.perf_counter()
+    combined = period_embeddings(period_selections[name], tweet_embeddings, valid).to_frame()
+    print(f'{name} from the tweet embeddings: {time.perf_counter() - start_time:,.2f} s')
+
+    assert (separate['author_id'].to_numpy() == combined['author_id'].to_numpy()).all()
+    assert np.allclose(np.stack(separate['embeddings']), np.stack(combined['embeddings']), atol=1e-6)
+    combined.to_feather(path + "embeddings.feather")
+
+
+# %%
+# Compare loading the user embedding matrix with loading embeddings.feather, and their file sizes
+for name, _, _, path in PERIODS:
+    start_time = time.perf_counter()
+    matrix = np.stack(pd.read_feather(path + "embeddings.feather")['embeddings'].to_numpy())
+    feather_load = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    user_embeddings = UserEmbeddings.load(path)
+    mmap_load = time.perf_counter() - start_time
+    np.asarray(user_embeddings.matrix).sum()  # NOTE: Memory-mapped, so the data is only read when it is used
+    mmap_read = time.perf_counter() - start_time
+
+    feather_size = os.path.getsize(path + "embeddings.feather")
+    matrix_size = os.path.getsize(path + 'user_embeddings.npy') + os.path.getsize(path + 'user_embeddings_author_ids.npy')
+    print(f'{name}: embeddings.feather {feather_size / 1e6:,.1f} MB, load and stack {feather_load:,.3f} s; '
+          f'matrix ({user_embeddings.matrix.dtype}) {matrix_size / 1e6:,.1f} MB, memory-map {mmap_load:,.4f} s, read all {mmap_read:,.3f} s')
+
+
+# %%
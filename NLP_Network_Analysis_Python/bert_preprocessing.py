@@ -0,0 +1,56 @@
+import multiprocessing
+import time
+
+from content_cache import ContentCache
+from src.tweet_preprocessing import preprocess_tweet_for_bert  # NOTE: src has to be on sys.path (see s4_ideology_detection.py)
+
+
+PREPROCESS_CACHE_VERSION = 'preprocess_tweet_for_bert_v1'  # NOTE: Change this whenever preprocess_tweet_for_bert changes, so that stale cached results are not reused
+
+
+def preprocess_texts(texts):
+    '''Preprocesses tweets with preprocess_tweet_for_bert: the tokens joined by spaces, or None for tweets of one token or less (which are dropped).'''
+    out = []
+    for text in texts:
+        tw = preprocess_tweet_for_bert(text)
+        out.append(" ".join(tw) if len(tw) > 1 else None)
+    return out
+
+
+def preprocess_texts_parallel(texts, n_workers=1, chunk_size=5_000):
+    '''Preprocesses tweets in chunks across a process pool. Chunks come back in input order, so the result is identical to preprocess_texts(texts).'''
+    texts = list(texts)
+    if n_workers <= 1:
+        return preprocess_texts(texts)
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+    # NOTE: 'fork', as spawned workers would re-import the script that called this one and run it again
+    with multiprocessing.get_context('fork').Pool(n_workers) as pool:
+        preprocessed_chunks = pool.map(preprocess_texts, chunks)
+
+    return [text for chunk in preprocessed_chunks for text in chunk]
+
+
+class PreprocessCache(ContentCache):
+    '''Content-addressed cache in front of preprocess_tweet_for_bert: every distinct tweet is preprocessed once, keyed by a hash of its text.'''
+
+    def __init__(self, path=None, n_workers=1, chunk_size=5_000):
+        super().__init__(PREPROCESS_CACHE_VERSION, ['text_preprocessed'], path)
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.seconds = 0.0
+
+    def compute(self, texts):
+        return preprocess_texts_parallel(texts, self.n_workers, self.chunk_size)
+
+    def preprocess(self, texts):
+        '''Preprocesses the distinct texts that are not cached yet and maps the results back to every row (see preprocess_texts).'''
+        start = time.perf_counter()
+        preprocessed = self.apply(texts).tolist()
+        self.seconds += time.perf_counter() - start
+        return preprocessed
+
+    def report(self):
+        print(f'Preprocessing: {self.rows:,} tweets in {self.seconds:,.1f} s ({self.rows / max(self.seconds, 1e-9):,.0f} rows/sec), '
+              f'{self.misses:,} distinct tweets preprocessed, the others were cached or duplicates')
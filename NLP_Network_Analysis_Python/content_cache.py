@@ -0,0 +1,81 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def content_key(text, version):
+    '''Hash of a text and of the version of the function applied to it, the key of the result in a ContentCache.
+
+    NOTE: The version is hashed with the text, as blake2b's person parameter only takes up to 16 bytes.
+    '''
+    return hashlib.blake2b(f'{version}\0{text}'.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+class ContentCache:
+    '''Content-addressed cache in front of a function of texts: every distinct text is passed to compute once, keyed by a hash of its content.
+
+    Subclasses implement compute, which maps a list of texts to a list of results. The results are tuples of the
+    columns they are saved in (path, a feather file with a 'key' column), or single values with one column. With
+    max_size, the least recently used entries are evicted first.
+    '''
+
+    def __init__(self, version, columns, path=None, max_size=None):
+        self.version = version
+        self.columns = list(columns)
+        self.path = path
+        self.max_size = max_size
+        self.entries = OrderedDict()  # NOTE: Kept in least to most recently used order
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(path):
+            stored = pd.read_feather(path)
+            if all(column in stored for column in self.columns):  # NOTE: Caches saved with other columns are not used
+                values = stored[self.columns[0]] if len(self.columns) == 1 else zip(*(stored[column] for column in self.columns))
+                self.entries.update(zip(stored['key'], values))
+
+    def key(self, text):
+        return content_key(text, self.version)
+
+    def compute(self, texts):
+        raise NotImplementedError
+
+    def apply(self, texts):
+        '''Computes the distinct texts that are not cached yet and returns an object array with the result of every row.'''
+        # NOTE: map keeps missing texts as 'nan', which astype(str) leaves missing from pandas 3 on (and factorize would code them -1)
+        codes, uniques = pd.factorize(pd.Series(texts, dtype=object).map(str))
+        keys = [self.key(text) for text in uniques]
+
+        results = np.empty(len(uniques), dtype=object)
+        missing = []
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                results[i] = self.entries[key]
+            else:
+                missing.append(i)
+
+        for i, result in zip(missing, self.compute(uniques[missing].tolist())):
+            results[i] = result
+            self.entries[keys[i]] = result
+
+        while self.max_size is not None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        self.rows += len(codes)
+        self.hits += len(uniques) - len(missing)
+        self.misses += len(missing)
+        return results[codes]
+
+    def save(self):
+        if self.path is None:
+            return
+        if len(self.columns) == 1:
+            values = [list(self.entries.values())]
+        else:
+            values = [list(column) for column in zip(*self.entries.values())] if self.entries else [[] for _ in self.columns]
+        pd.DataFrame({'key': list(self.entries.keys()), **dict(zip(self.columns, values))}).to_feather(self.path)
@@ -0,0 +1,117 @@
+import hashlib
+import os
+
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class DocumentTermVectorizer:
+    '''Vectorizer for BERTopic that counts terms from a precomputed document-term matrix instead of the texts.
+
+    BERTopic joins the documents of each topic (or topic and time bin) with spaces and vectorizes the result. When
+    the documents handed to BERTopic are the row numbers of the real documents in the matrix (see document_ids),
+    the joined "texts" are lists of row numbers, and their term counts are sums of matrix rows. Terms are kept if
+    they occur in at least min_df of the vectorized documents, as with CountVectorizer. With weights, the row of
+    each document counts weights[row] times (e.g. the number of tweets with a text, when the documents are distinct texts).
+
+    NOTE: Unlike CountVectorizer on the joined texts, n-grams that span two joined documents are not counted.
+    NOTE: This relies on BERTopic passing the IDs through its preprocessing and joining unchanged, which is not part of
+    its API: check_preprocessing verifies the preprocessing, and every vectorized document must consist of valid IDs.
+    '''
+
+    def __init__(self, dtm, vocabulary, min_df=1, weights=None, **count_vectorizer_params):
+        self.dtm = dtm.tocsr()
+        self.weights = np.ones(self.dtm.shape[0], dtype=self.dtm.dtype) if weights is None else np.asarray(weights, dtype=self.dtm.dtype)
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.min_df = min_df
+        self.count_vectorizer_params = count_vectorizer_params
+        self.columns_ = np.arange(len(self.vocabulary))
+        self._fitted = None  # NOTE: (documents, counts) of the last fit, BERTopic transforms the same documents right after fitting
+
+    @classmethod
+    def from_documents(cls, docs, path=None, min_df=1, weights=None, **count_vectorizer_params):
+        '''Builds the document-term matrix of docs, or loads it from path if it was saved there for the same docs and parameters.
+
+        NOTE: Terms in fewer than min_df docs cannot be in min_df joined documents, so they are dropped from the matrix right away.
+        '''
+        # NOTE: The fingerprint covers everything the matrix depends on: the CountVectorizer parameters (min_df included), the sklearn version and the docs
+        settings = sorted({'min_df': min_df, **count_vectorizer_params}.items())
+        digest = hashlib.blake2b(repr((sklearn.__version__, settings)).encode(), digest_size=16)
+        for doc in docs:
+            digest.update(doc.encode('utf-8', 'surrogatepass') + b'\0')
+        fingerprint = digest.hexdigest()
+
+        if path is not None and os.path.exists(path + fingerprint + '.npz'):
+            dtm = sp.load_npz(path + fingerprint + '.npz')
+            vocabulary = np.load(path + fingerprint + '.vocabulary.npy', allow_pickle=True)
+        else:
+            vectorizer = CountVectorizer(min_df=min_df, **count_vectorizer_params)
+            dtm = vectorizer.fit_transform(docs)
+            vocabulary = vectorizer.get_feature_names_out()
+            if path is not None:
+                os.makedirs(path, exist_ok=True)
+                sp.save_npz(path + fingerprint + '.npz', dtm)
+                np.save(path + fingerprint + '.vocabulary.npy', vocabulary.astype(object), allow_pickle=True)
+
+        return cls(dtm, vocabulary, min_df=min_df, weights=weights, **count_vectorizer_params)
+
+    def document_ids(self):
+        '''The documents to hand to BERTopic in place of the texts: the row number of each document as a string.'''
+        return [str(i) for i in range(self.dtm.shape[0])]
+
+    def check_preprocessing(self, preprocess):
+        '''Raises a ValueError if preprocess (BERTopic's text preprocessing, e.g. topic_model._preprocess_text) changes the document IDs.'''
+        ids = self.document_ids()
+        sample = ids[:10] + ids[-10:] + [' '.join(ids[:10])]
+        preprocessed = [str(document) for document in preprocess(np.array(sample, dtype=object))]
+        if preprocessed != sample:
+            raise ValueError(f'BERTopic\'s preprocessing changes the document IDs (e.g. {sample[-1]!r} became {preprocessed[-1]!r}), '
+                             'DocumentTermVectorizer cannot be used with this version of BERTopic')
+
+    def _counts(self, documents):
+        rows, ids = [], []
+        for row, document in enumerate(documents):
+            tokens = document.split()
+            if tokens == ['emptydoc']:  # NOTE: BERTopic hands 'emptydoc' for empty documents
+                continue
+            if not all(token.isdigit() for token in tokens):
+                raise ValueError(f'Expected document IDs, got {document[:100]!r}: BERTopic no longer passes the IDs through unchanged, '
+                                 'or it was handed texts instead of document_ids()')
+            rows.extend([row] * len(tokens))
+            ids.extend(int(token) for token in tokens)
+
+        if ids and max(ids) >= self.dtm.shape[0]:
+            raise ValueError(f'Document ID {max(ids)} is out of range for a document-term matrix of {self.dtm.shape[0]:,} documents')
+
+        # Each joined document sums the (weighted) matrix rows of the documents it consists of (repeated documents count repeatedly)
+        selection = sp.csr_matrix((self.weights[ids], (rows, ids)), shape=(len(documents), self.dtm.shape[0]))
+        return (selection @ self.dtm).tocsr()
+
+    def fit(self, documents, y=None):
+        counts = self._counts(documents)
+        document_frequency = np.asarray((counts > 0).sum(axis=0)).ravel()
+        self.columns_ = np.flatnonzero(document_frequency >= self.min_df)
+        self._fitted = (documents, counts)
+        return self
+
+    def transform(self, documents):
+        if self._fitted is not None and self._fitted[0] is documents:
+            counts = self._fitted[1]
+        else:
+            counts = self._counts(documents)
+        self._fitted = None
+        return counts[:, self.columns_]
+
+    def fit_transform(self, documents, y=None):
+        return self.fit(documents).transform(documents)
+
+    def get_feature_names_out(self):
+        return self.vocabulary[self.columns_]
+
+    def to_count_vectorizer(self):
+        '''A CountVectorizer with the current vocabulary, which works on texts again (e.g. to save the topic model with).'''
+        vectorizer = CountVectorizer(vocabulary=self.get_feature_names_out().tolist(), **self.count_vectorizer_params)
+        return vectorizer.fit(['emptydoc'])  # NOTE: Fitting with a fixed vocabulary only sets it up
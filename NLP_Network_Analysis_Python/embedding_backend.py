@@ -0,0 +1,74 @@
+import multiprocessing
+
+import numpy as np
+import torch
+
+from sentence_transformers import SentenceTransformer
+
+
+# NOTE: Set right before the worker pool is forked, so that the workers use the parent's model without pickling it
+_worker_model = None
+
+
+def _init_worker():
+    # NOTE: One thread per worker. The workers are forked from a parent whose OpenMP thread pool may already be running
+    # (e.g. after loading or quantizing the model), and using that pool in a forked process can deadlock
+    torch.set_num_threads(1)
+
+
+def _encode_chunk(args):
+    texts, batch_size = args
+    return _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+class EmbeddingBackend:
+    '''Encodes texts with a SentenceTransformer, on CUDA when it is available and otherwise in an optimised CPU mode.
+
+    With several workers, the CPU mode sorts the texts by token length, so that each chunk holds texts of similar length
+    and little padding, and spreads the chunks over a pool of single-threaded worker processes. With one worker (the
+    default) the texts are encoded in this process with torch's own threads. The CPU mode can use an int8-quantized model.
+    '''
+
+    def __init__(self, model_name, device=None, n_workers=1, batch_size=32, chunk_size=2048, quantize=False):
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size  # NOTE: Number of texts handed to a worker at a time
+
+        self.model = SentenceTransformer(model_name, device=self.device)
+        if quantize and self.device == 'cpu':
+            # Dynamic int8 quantization of the linear layers, which hold most of the model's compute
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def token_lengths(self, texts, chunk_size=100_000):
+        '''Number of tokens of each text after truncation to the model's maximum sequence length.'''
+        lengths = []
+        for i in range(0, len(texts), chunk_size):
+            tokens = self.model.tokenizer(texts[i:i + chunk_size], truncation=True, max_length=self.model.max_seq_length,
+                                          return_length=True, return_attention_mask=False, return_token_type_ids=False)
+            lengths.extend(tokens['length'])
+        return np.array(lengths)
+
+    def encode(self, texts, show_progress_bar=False):
+        '''Returns the embeddings of texts as a float32 matrix, in the order of texts.'''
+        texts = list(texts)
+        if self.device != 'cpu' or self.n_workers <= 1:
+            # NOTE: SentenceTransformer.encode sorts the texts of a call by length itself, so they are only sorted here to chunk them for the workers
+            return self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=show_progress_bar, convert_to_numpy=True)
+
+        # NOTE: A stable sort, so that equally long texts keep their order and the chunks do not depend on the number of workers
+        order = np.argsort(self.token_lengths(texts), kind='stable')
+        sorted_texts = [texts[i] for i in order]
+
+        global _worker_model
+        _worker_model = self.model
+
+        chunks = [(sorted_texts[i:i + self.chunk_size], self.batch_size) for i in range(0, len(sorted_texts), self.chunk_size)]
+
+        # NOTE: 'fork', as spawned workers would re-run the calling script (which has no __main__ guard)
+        with multiprocessing.get_context('fork').Pool(self.n_workers, initializer=_init_worker) as pool:
+            sorted_embeddings = np.concatenate(pool.map(_encode_chunk, chunks))
+
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
@@ -0,0 +1,133 @@
+import glob
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def text_keys(texts):
+    '''Hashes of the texts, used as their keys in the embedding store.'''
+    return np.array([hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest() for text in texts], dtype='S16')
+
+
+class EmbeddingStore:
+    '''Persistent sentence-embedding store for one model, keyed by a hash of the text.
+
+    The embeddings are stored in segments: one memory-mapped .npy matrix per call that encoded new texts, next to
+    an array with the keys of its rows. Texts that are already in the store are read from disk instead of encoded.
+    Processes that share the store (s2 and s4) can append the same key in segments of their own; such a key is
+    looked up at its first row, and compact keeps only that row.
+    '''
+
+    def __init__(self, path, model_name, dtype='float32'):
+        self.path = os.path.join(path, model_name.replace('/', '__'), '')
+        self.dtype = np.dtype(dtype)  # NOTE: 'float16' halves the size of new segments, embeddings are always returned as float32
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _segment_names(self):
+        return sorted(os.path.basename(file)[len('embeddings-'):-len('.npy')] for file in glob.glob(self.path + 'embeddings-*.npy'))
+
+    def _load(self):
+        names = self._segment_names()
+        self.segments = [np.load(f'{self.path}embeddings-{name}.npy', mmap_mode='r') for name in names]
+        keys = [np.load(f'{self.path}keys-{name}.npy') for name in names]
+
+        self.offsets = np.cumsum([0] + [len(segment_keys) for segment_keys in keys])
+        self.index = pd.Index(np.concatenate(keys) if keys else np.array([], dtype='S16'), dtype=object)
+        self._build_lookup()
+
+    def _build_lookup(self):
+        '''Index of the distinct keys and the position of each in the store (its first row).'''
+        first = ~self.index.duplicated(keep='first')
+        self.lookup = self.index[first]
+        self.lookup_positions = np.flatnonzero(first)
+
+    def _positions(self, keys):
+        '''Positions in the store of the keys, -1 for keys that are not in it.'''
+        positions = self.lookup.get_indexer(pd.Index(keys, dtype=object))
+        found = positions >= 0  # NOTE: Only these are looked up, -1 would index the last row (and fails on an empty store)
+        store_positions = np.full(len(positions), -1, dtype=np.int64)
+        store_positions[found] = self.lookup_positions[positions[found]]
+        return store_positions
+
+    def _save(self, array, file):
+        # NOTE: Written to a temporary file first, so that a crash never leaves a truncated segment behind
+        with open(file + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(file + '.tmp', file)
+
+    def _append(self, keys, embeddings):
+        name = f'{time.time_ns():020d}'
+        self._save(keys, f'{self.path}keys-{name}.npy')  # NOTE: Keys first, segments are discovered through their embeddings file
+        self._save(embeddings, f'{self.path}embeddings-{name}.npy')
+
+        self.segments.append(np.load(f'{self.path}embeddings-{name}.npy', mmap_mode='r'))
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(keys))
+        self.index = self.index.append(pd.Index(keys, dtype=object))
+        # NOTE: Appended keys are not in the store yet (see encode), so they extend the lookup as they are
+        self.lookup = self.lookup.append(pd.Index(keys, dtype=object))
+        self.lookup_positions = np.append(self.lookup_positions, np.arange(self.offsets[-2], self.offsets[-1]))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _rows(self, positions, dim):
+        '''Reads the embeddings at the given positions of the store into a float32 matrix, segment by segment.'''
+        out = np.empty((len(positions), dim), dtype=np.float32)
+        segment_ids = np.searchsorted(self.offsets, positions, side='right') - 1
+        for segment_id in np.unique(segment_ids):
+            mask = segment_ids == segment_id
+            out[mask] = self.segments[segment_id][positions[mask] - self.offsets[segment_id]]
+        return out
+
+    def encode(self, texts, encode_fn):
+        '''Returns the float32 embeddings of texts. Only distinct texts that are not in the store are passed to encode_fn, and then stored.'''
+        codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object))
+        keys = text_keys(uniques)
+
+        positions = self._positions(keys)
+        missing = np.flatnonzero(positions == -1)
+
+        self.hits += len(uniques) - len(missing)
+        self.misses += len(missing)
+
+        if len(missing) > 0:
+            embeddings = np.asarray(encode_fn(uniques[missing].tolist()), dtype=self.dtype)
+            self._append(keys[missing], embeddings)
+            positions[missing] = self.offsets[-2] + np.arange(len(missing))
+
+        dim = self.segments[0].shape[1] if self.segments else 0
+        return self._rows(positions, dim)[codes]
+
+    def compact(self, keep_texts=None):
+        '''Merges all segments into one. With keep_texts, only the embeddings of these texts are kept.'''
+        old_names = self._segment_names()
+        if not old_names:
+            return
+
+        positions = self.lookup_positions
+        if keep_texts is not None:
+            positions = self._positions(text_keys(set(keep_texts)))
+            positions = np.sort(positions[positions >= 0])
+
+        keys = np.array(self.index[positions], dtype='S16')
+        embeddings = self._rows(positions, self.segments[0].shape[1]).astype(self.dtype)
+
+        self.segments, self.offsets, self.index = [], np.array([0]), pd.Index([], dtype=object)
+        self._build_lookup()
+        self._append(keys, embeddings)
+        for name in old_names:
+            os.remove(f'{self.path}embeddings-{name}.npy')
+            os.remove(f'{self.path}keys-{name}.npy')
+        self._load()
+
+    def report(self):
+        distinct = self.hits + self.misses
+        print(f'Embedding store ({self.path}): {len(self):,} embeddings in {len(self.segments)} segment(s)')
+        print(f'Embedding store ({self.path}): {self.hits:,} of {distinct:,} distinct texts were stored ({self.hits / max(distinct, 1):.1%} hit rate), {self.misses:,} were encoded')
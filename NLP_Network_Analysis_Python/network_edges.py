@@ -0,0 +1,97 @@
+import pandas as pd
+
+
+def sliding_windows(start, end, length, step, path):
+    '''Windows of length days starting every step days from start, up to the last one that ends by end (e.g. weekly: length=7, step=7).
+
+    The results of each window go to a directory of its own in path.
+    '''
+    starts = pd.date_range(start, pd.Timestamp(end) - pd.Timedelta(days=length - 1), freq=f'{step}D')
+    return [(f'{window_start:%Y-%m-%d}_{length}d', f'{window_start:%Y-%m-%d}', f'{window_start + pd.Timedelta(days=length - 1):%Y-%m-%d}',
+             path + f'windows/{window_start:%Y-%m-%d}_{length}d/') for window_start in starts]
+
+
+def as_ns(timestamps, tz=None):
+    '''Timestamps as int64 nanoseconds since the epoch (in UTC for time-zone aware ones), for comparisons with numpy.
+
+    A Series of timestamps keeps its time zone (e.g. UTC, as s2 parses 'created_at'); date strings are localized to tz.
+    '''
+    if isinstance(timestamps, pd.Series):
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+        return timestamps.dt.as_unit('ns').astype('int64').to_numpy()
+    return pd.DatetimeIndex(timestamps, tz=tz).as_unit('ns').asi8
+
+
+def window_bounds(windows, tz=None):
+    '''Start and end of each of the windows as int64 nanoseconds.
+
+    NOTE: The dates are compared like strings with 'created_at' are, i.e. as midnight in its time zone tz.
+    '''
+    return as_ns([start for _, start, _, _ in windows], tz), as_ns([end for _, _, end, _ in windows], tz)
+
+
+def window_membership(created_at, windows):
+    '''Boolean matrix of which of the windows each timestamp in created_at falls in, computed for all windows at once.'''
+    starts, ends = window_bounds(windows, created_at.dt.tz)
+    created = as_ns(created_at)[:, None]
+    return (created >= starts) & (created <= ends)
+
+
+def retweet_stream(df):
+    '''All retweets among the tweets of df, joined with the original tweets: user IDs and creation times of both.'''
+    # Keep retweets ONLY and convert their IDs to int64 (the type of 'id'; every retweet has an 'action_id')
+    retweets = df.loc[df['action'] == 'retweeted', ['action_id', 'user_id', 'created_at']]
+    retweets['action_id'] = retweets['action_id'].astype('int64')
+
+    # Merge the two data frames, in order to find all retweets among MPs
+    merged = pd.merge(retweets, df[['id', 'user_id', 'created_at']], left_on='action_id', right_on='id',
+                      suffixes=('_retweet', '_original'))
+
+    # Remove edges where users retweet themselves
+    return merged[merged['user_id_retweet'] != merged['user_id_original']]
+
+
+def retweet_edges(df, windows):
+    '''Retweet edges (source retweeted target) among the tweets of df, for each of the windows.
+
+    The retweets are joined with the original tweets once. An edge belongs to a window if both the retweet and the
+    original tweet were created in it, as when both are selected by period before the join.
+    '''
+    merged = retweet_stream(df)
+
+    # Edges × windows membership, in one pass over all windows
+    in_window = window_membership(merged['created_at_retweet'], windows) & window_membership(merged['created_at_original'], windows)
+
+    edges = merged[['user_id_retweet', 'user_id_original']].rename(columns={'user_id_retweet': 'source', 'user_id_original': 'target'})
+    return {name: edges[in_window[:, i]] for i, (name, _, _, _) in enumerate(windows)}
+
+
+def mention_edges(df, windows):
+    '''Mention edges (source mentioned target) of the tweets of df, for each of the windows the tweet was created in.
+
+    The mentioned users are the MEPs and Commissioners that s1 resolved the tweet's handles to ('mentioned_user_ids').
+    NOTE: Retweets are left out, as their text is the original tweet's (and its 'RT @' handle is the retweet itself).
+    '''
+    mentions = df.loc[df['action'] != 'retweeted', ['user_id', 'created_at', 'mentioned_user_ids']].explode('mentioned_user_ids')
+    mentions = mentions.dropna(subset=['mentioned_user_ids'])  # NOTE: Tweets without mentions explode into one empty row
+    mentions = mentions.rename(columns={'user_id': 'source', 'mentioned_user_ids': 'target'}).astype({'target': 'int64'})
+
+    # Remove edges where users mention themselves
+    mentions = mentions[mentions['source'] != mentions['target']]
+
+    in_window = window_membership(mentions['created_at'], windows)
+    edges = mentions[['source', 'target']]
+    return {name: edges[in_window[:, i]] for i, (name, _, _, _) in enumerate(windows)}
+
+
+def create_nodes(edges):
+    '''Nodes of the edges, labelled by user ID and numbered from 1 in order of appearance.
+
+    NOTE: The user IDs are int64 from s1 on; in nodes.csv and edges.csv they are written as the same digits as before.
+    '''
+    unique_nodes = pd.unique(edges[['source', 'target']].values.ravel('K'))
+
+    nodes = pd.DataFrame({'label': unique_nodes})
+    nodes.insert(0, 'id', range(1, len(nodes) + 1))  # Add 'id' column
+    return nodes
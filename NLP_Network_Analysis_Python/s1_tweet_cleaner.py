@@ -1,81 +1,50 @@
 # %%
-import contractions  
-import html
-import json
 import numpy as np
-import pandas as pd 
-import re
-import regex
+import os
+import pandas as pd
 
-from textacy import preprocessing
+from tweet_cleaning import CleanTextCache, handle_index, resolve_mentions
+from tweet_loading import final_partitions, final_schema, load_translated_tweets, new_tweets, parse_referenced_tweets, processed_id_files, processed_ids, read_partitions, read_tweets, write_partition
 
 DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  
+FINAL_PATH = DATA_PATH + 'bigsss_tweets_FINAL/'  # NOTE: Partitioned dataset with one feather file per run, later scripts read all partitions as one table
 
+PROCESSED_IDS_PATH = DATA_PATH + 'bigsss_tweets_FINAL_processed/'  # NOTE: IDs of the tweets each run merged with their translation, including those it dropped for an empty clean text
 
-# Functions
-def clean_text(text):
-    text = str(text)
-    text = html.unescape(text)  # Replaces HTML characters
-    text = re.sub('VIDEO:|AUDIO:', ' ', text)  # Removes specific tags like 'VIDEO:' 
-    text = re.sub(r'http\S+|www.\S+|bit.ly/\S+|pic.twitter\S+', ' ', text)  # Removes URLs
-    text = preprocessing.normalize.quotation_marks(text)  
-    text = text.encode('ascii', 'ignore').decode()  # Removes non ASCII characters 
-    text = re.sub(r'\s+', ' ', text).strip()  # Removes unicode whitespace characters
-    text = re.sub(r'\\r|\\n|\\t|\\f|\\v', ' ', text)  # For messy data, removes unicode whitespace characters
-    text = re.sub(r'(^|[^@\w])@(\w{1,15})\b', ' ', text)  # Replaces twitter handles and emails
-    text = preprocessing.replace.emails(text, repl=' ') 
-    text = re.sub(r'\$\w*', ' ', text)  # Removes tickers
-    text = preprocessing.remove.accents(text)   
-    text = text.replace('-', ' ').replace('–', ' ')  # Replaces dashes and special characters
-    text = preprocessing.normalize.unicode(text)  
-    text = regex.compile('[ha][ha]+ah[ha]+').sub('haha', text)  
-    text = text.replace('&', ' and ')  
-    text = re.sub(r'([A-Za-z])\1{2,}', r'\1', text)  # Removes repeated characters
-    text = re.sub(r'\b([a-zA-Z]{1,3})(\.[a-zA-Z]{1,3}\.?)+\b', lambda match: match.group(0).replace('.', ''), text)  # Handles abbreviations with multiple dots
-    text = contractions.fix(text, slang=True)  
-    text = regex.compile(r'(?:(?=\b(?:\p{Lu} +){2}\p{Lu})|\G(?!\A))\p{Lu}\K +(?=\p{Lu}(?!\p{L}))').sub('', text)  # Replaces kerned
-    text = text.lower()
-    text = re.sub(r'[^a-zA-Z]+', ' ', text)  # Removes numbers, special characters, etc.
-    text = preprocessing.normalize.whitespace(text)  # Normalises whitespace 
-    return text
-
-
-def extract_info(lst):
-    '''Extracts information from a list of dictionaries and concatenates the values.'''
-    values = [list(d.values()) for d in lst if isinstance(d, dict)]
-    return ','.join(str(value) for sublist in values for value in sublist)
+INCREMENTAL = False  # NOTE: Set to True to only process tweets that no earlier run processed (see PROCESSED_IDS_PATH) and add them as a new partition
 
 
-# Load and transform raw tweets 
-with open(DATA_PATH + 'bigsss_tweets.json', 'r') as file:
-    data = json.load(file)
-
-df = pd.DataFrame(data) 
-
-df = df[['id', 'author_id', 'created_at', 'text', 'referenced_tweets']]  # Keep certain columns
+# Parallel cleaning
+N_WORKERS = 1  # NOTE: Number of processes used to clean tweets, 1 cleans them serially in this process
+CHUNK_SIZE = 20_000  # NOTE: Number of tweets handed to a worker at a time
 
+# Cleaning cache
+CLEAN_CACHE_PATH = None  # NOTE: e.g. DATA_PATH + 'clean_text_cache.feather' to keep cleaned tweets across runs; None keeps them for this run only
+CLEAN_CACHE_SIZE = 5_000_000  # NOTE: Maximum number of cleaned tweets in the cache, the least recently used ones are evicted first
 
-# Extract info from df_raw['referenced_tweets'] and split column. Assign its values to two new columns 
-df['referenced_tweets'] = df['referenced_tweets'].apply(extract_info)
+# Streaming ingestion
+READ_CHUNK_SIZE = 100_000  # NOTE: Number of raw tweets parsed into one DataFrame chunk, bounds the memory used while reading
 
-split_values = df['referenced_tweets'].str.split(',', n=1, expand=True)
 
-df['action'] = split_values[0]
-df['action_id'] = split_values[1]
-
-
-# Load translated tweets 
-df_translated = pd.read_feather(DATA_PATH + 'bigsss_tweets_translated.feather')
+# %%
+# Load and transform raw tweets 
+# NOTE: The JSON file is streamed in chunks and only the RAW_COLUMNS are kept, so it is never held in memory as a whole
+# NOTE: 'referenced_tweets' is decoded into 'action' and 'action_id' chunk by chunk while reading
+# NOTE: In INCREMENTAL mode, tweets that are already in FINAL_PATH are dropped from each chunk right away
+existing_ids = processed_ids(PROCESSED_IDS_PATH, FINAL_PATH) if INCREMENTAL else pd.Index([])
 
-df_translated = df_translated[['id', 'text_translated', 'name', 'username', 'day', 'month', 'year', 'dob', 'full_name', 'sex', 'country', 'nat_party', 'nat_party_abb', 'eu_party_group', 'eu_party_abbr', 'commission_dummy', 'party_id', 'eu_position', 'lrgen', 'lrecon', 'galtan', 'eu_eu_position', 'eu_lrgen', 'eu_lrecon', 'eu_galtan']]  # Keep certain columns
+df = pd.concat([parse_referenced_tweets(new_tweets(chunk, existing_ids)) for chunk in read_tweets(DATA_PATH + 'bigsss_tweets.json', READ_CHUNK_SIZE)], ignore_index=True)
 
+print(f'{len(df):,} tweets to process ({len(existing_ids):,} processed in earlier runs)')
 
-# Convert IDs to str 
-df_translated['id'] = df_translated['id'].astype(str)
 
-df['id'] = df['id'].astype(str)
+# %%
+# Load translated tweets (certain columns only)
+# NOTE: IDs are int64 in both data frames, so they are merged without converting them to str
+df_translated = load_translated_tweets(DATA_PATH + 'bigsss_tweets_translated.feather')
 
 
+# %%
 # Merge data frames 
 df_merged = pd.merge(df_translated, df, on='id', how='inner')
 
@@ -85,17 +54,52 @@ df_merged = df_merged[['id', 'author_id', 'created_at', 'text', 'text_translated
 # Rename 'author_id' column to 'user_id'
 df_merged = df_merged.rename(columns={'author_id': 'user_id'})
 
+# IDs of the tweets that reached the merge, recorded as processed once the partition is written
+merged_ids = df_merged['id'].to_numpy()
 
+
+# %%
 # Clean tweets
-df_merged['text_clean'] = df_merged['text_translated'].apply(clean_text)
+# NOTE: Retweets repeat the same text, so each distinct text is cleaned only once (see CleanTextCache)
+# NOTE: The twitter handles the cleaning removes are kept in 'mentions', to build the mention networks in s3
+clean_cache = CleanTextCache(CLEAN_CACHE_PATH, CLEAN_CACHE_SIZE, N_WORKERS, CHUNK_SIZE)
+df_merged['text_clean'], df_merged['mentions'] = clean_cache.clean(df_merged['text_translated'])
+clean_cache.report()
+clean_cache.save()
 
 # Remove empty cells
-df_merged = df_merged.replace(r'^\s*$', np.nan, regex=True)  
+# NOTE: Only string columns can hold empty cells here (empty categorical cells are already NaN, 'action_id' is an integer)
+string_columns = df_merged.select_dtypes('object').columns
+df_merged[string_columns] = df_merged[string_columns].replace(r'^\s*$', np.nan, regex=True)  
 df_merged = df_merged.dropna(subset=['text_clean'])
 
-
-# Save tweets
-df_merged.to_feather(DATA_PATH + 'bigsss_tweets_FINAL.feather')
+# Resolve the mentioned handles to the user IDs of the MEPs and Commissioners (mentions of other accounts are dropped)
+# NOTE: In INCREMENTAL mode, the users in the earlier partitions are indexed as well
+users = df_merged[['username', 'user_id']]
+if INCREMENTAL and final_partitions(FINAL_PATH):
+    users = pd.concat([users, read_partitions(FINAL_PATH, ['username', 'user_id'])])
+mention_index = handle_index(users)
+df_merged['mentioned_user_ids'] = resolve_mentions(df_merged.pop('mentions').fillna(''), mention_index)
+print(f"{sum(len(ids) > 0 for ids in df_merged['mentioned_user_ids']):,} tweets mention known users ({len(mention_index):,} handles in the index)")
+
+
+# Save tweets as a new partition
+# NOTE: A full run replaces all partitions, an INCREMENTAL run adds one next to the existing ones
+os.makedirs(FINAL_PATH, exist_ok=True)
+os.makedirs(PROCESSED_IDS_PATH, exist_ok=True)
+
+if not INCREMENTAL:
+    for partition in final_partitions(FINAL_PATH) + processed_id_files(PROCESSED_IDS_PATH):
+        os.remove(partition)
+
+if len(df_merged) > 0:
+    write_partition(df_merged, final_schema(DATA_PATH + 'bigsss_tweets_translated.feather'), FINAL_PATH)
+
+# Record the tweets that reached the merge, also those dropped for an empty clean text, so that INCREMENTAL runs do not process them again
+# NOTE: Tweets without a translation are not recorded, so that a later run processes them once they are translated
+# NOTE: Written after the partition, so that a run that fails before it is repeated as a whole
+if len(merged_ids) > 0:
+    pd.DataFrame({'id': merged_ids}).to_feather(PROCESSED_IDS_PATH + f'processed-{len(processed_id_files(PROCESSED_IDS_PATH)):05d}.feather')
 
 
 # %%
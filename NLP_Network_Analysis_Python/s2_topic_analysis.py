@@ -6,16 +6,28 @@
 # From here: https://maartengr.github.io/BERTopic/getting_started/best_practices/best_practices.html#preventing-stochastic-behavior
 # BERTopic. NOTE: We include all tweets and retweets for topic analysis
 
+import copy
+import time
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objs as go
+import pyarrow.dataset as ds
+import torch
 
 from bertopic import BERTopic
 from bertopic.representation import MaximalMarginalRelevance
+from collections import Counter
+from document_term_matrix import DocumentTermVectorizer
+from embedding_backend import EmbeddingBackend
+from embedding_store import EmbeddingStore
 from hdbscan import HDBSCAN
 from sentence_transformers import SentenceTransformer
+from sklearn.base import clone
 from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+from topic_time_cube import TopicTimeCube
 from umap import UMAP
 
 from tqdm import tqdm
@@ -29,11 +41,30 @@ SENTENCE_MODEL = 'all-mpnet-base-v2' # The default is: 'all-MiniLM-L6-v2'
 
 DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  
 BERTOPIC_RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/bertopic_results/'
+EMBEDDINGS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/embeddings/'  # NOTE: Embedding store shared with s4
+DTM_PATH = BERTOPIC_RESULTS_PATH + 'document_term_matrix/'  # NOTE: Saved document-term matrices, reused by reruns on the same documents
+TIME_SLICES = ['eu_party_group', 'country']  # NOTE: Columns the topics over time can be sliced by
+
+EMBEDDING_DTYPE = 'float32'  # NOTE: 'float16' halves the size of the embedding store
+
+# Embedding backend
+EMBEDDING_DEVICE = None  # NOTE: None uses CUDA when it is available and the CPU otherwise
+EMBEDDING_WORKERS = 1  # NOTE: Number of single-threaded worker processes in CPU mode, 1 encodes in this process with all of torch's threads
+EMBEDDING_QUANTIZE = False  # NOTE: Set to True to use an int8-quantized model in CPU mode (faster, but slightly different embeddings)
+
+# Topic modelling
+DEDUP_DOCUMENTS = False  # NOTE: Set to True to fit the topic model on distinct texts only (retweets repeat their original's text) and map the topics back to every tweet; this changes the topic numbering, so check topics_to_merge and the Russo-Ukraine topic below
+FIT_SAMPLE_SIZE = None  # NOTE: e.g. 500_000 to fit UMAP/HDBSCAN on a sample of documents stratified by week and eu_party_group and assign the others in batches; None fits on all documents
+TRANSFORM_BATCH_SIZE = 50_000  # NOTE: Number of documents assigned to topics at a time in the sample-fit mode, bounds its peak memory
+AGREEMENT_SAMPLE = 100_000  # NOTE: Number of tweets on which the dedup and sample-fit modes are compared with a full fit
+
+BENCHMARK = False  # NOTE: Set to True to compare the throughput of the embedding modes, the topics of the dedup and sample-fit modes with a full fit, the time spent after fitting, and the topics over time with BERTopic's
 
 
 # %%
 # Load tweets (clean and translated)
-df = pd.read_feather(DATA_PATH + 'bigsss_tweets_FINAL.feather')
+# NOTE: s1 writes one partition per run, they are read as one table
+df = ds.dataset(DATA_PATH + 'bigsss_tweets_FINAL/', format='feather').to_table().to_pandas()
 
 
 # %%
@@ -43,9 +74,118 @@ df = pd.read_feather(DATA_PATH + 'bigsss_tweets_FINAL.feather')
 df_text_clean = df['text_clean'].tolist()
 
 # Pre-calculate embeddings
-embedding_model = SentenceTransformer(SENTENCE_MODEL, device='cuda')
-embeddings = embedding_model.encode(df_text_clean, show_progress_bar=True)
+# NOTE: Only texts that are not in the embedding store yet (from earlier runs or s4) are encoded
+embedding_backend = EmbeddingBackend(SENTENCE_MODEL, device=EMBEDDING_DEVICE, n_workers=EMBEDDING_WORKERS, quantize=EMBEDDING_QUANTIZE)
+embedding_model = embedding_backend.model
+
+# NOTE: Quantized embeddings differ slightly, so they are stored apart from the full-precision ones
+embedding_store = EmbeddingStore(EMBEDDINGS_PATH, SENTENCE_MODEL + ('-int8' if EMBEDDING_QUANTIZE and embedding_backend.device == 'cpu' else ''), dtype=EMBEDDING_DTYPE)
+
+embeddings = embedding_store.encode(df_text_clean, lambda texts: embedding_backend.encode(texts, show_progress_bar=True))
+embedding_store.report()
+
+# Compact the embedding store (merges its segments; keep_texts drops the embeddings of all other texts)
+# embedding_store.compact(keep_texts=df_text_clean)
+
+
+# %%
+# Compare the throughput of the embedding modes on a fixed sample of tweets
+if BENCHMARK:
+    benchmark_sample = df['text_clean'].sample(n=min(5_000, len(df)), random_state=42).tolist()
+
+    benchmark_workers = torch.get_num_threads()  # NOTE: As many single-threaded workers as threads in the in-process modes
+
+    modes = [
+        ('cpu', SentenceTransformer(SENTENCE_MODEL, device='cpu').encode),
+        (f'cpu, length-sorted, {benchmark_workers} workers', EmbeddingBackend(SENTENCE_MODEL, device='cpu', n_workers=benchmark_workers).encode),
+        (f'cpu, length-sorted, {benchmark_workers} workers, int8', EmbeddingBackend(SENTENCE_MODEL, device='cpu', n_workers=benchmark_workers, quantize=True).encode),
+    ]
+    if torch.cuda.is_available():
+        modes.append(('cuda', EmbeddingBackend(SENTENCE_MODEL, device='cuda').encode))
+
+    for name, encode in modes:
+        start = time.perf_counter()
+        encode(benchmark_sample)
+        print(f'{name}: {len(benchmark_sample) / (time.perf_counter() - start):,.0f} tweets/sec')
+
+
+# %%
+# Documents the topic model is fitted on
+# NOTE: In DEDUP_DOCUMENTS mode these are the distinct texts; doc_codes maps every tweet to its text, so that topics can be mapped back.
+# UMAP and HDBSCAN take no sample weights, so each distinct text counts once when clustering. The term counts of the topic representations
+# (from update_topics on, see dtm_vectorizer) and the topic sizes count every tweet, with fit_weights the number of tweets per text.
+if DEDUP_DOCUMENTS:
+    doc_codes, fit_docs = pd.factorize(df['text_clean'])
+    fit_docs = fit_docs.tolist()
+    fit_rows = np.unique(doc_codes, return_index=True)[1]  # First tweet with each text
+    fit_weights = np.bincount(doc_codes, minlength=len(fit_docs))
+else:
+    doc_codes = np.arange(len(df_text_clean))
+    fit_docs = df_text_clean
+    fit_rows = doc_codes
+    fit_weights = None
+
+fit_embeddings = embeddings[fit_rows]
+
+# Strata for the sample-fit mode: week and EU party group of each document (of its first tweet in DEDUP_DOCUMENTS mode)
+fit_strata = pd.to_datetime(df['created_at'].iloc[fit_rows]).dt.strftime('%G-%V') + '|' + df['eu_party_group'].iloc[fit_rows].astype(str)
+
+print(f'Fitting on {len(fit_docs):,} documents for {len(df_text_clean):,} tweets')
+
+
+def count_all_tweets(topic_model):
+    '''Sets the topic sizes to the number of tweets per topic, duplicates included (in DEDUP_DOCUMENTS mode they count distinct texts).'''
+    topic_model.topic_sizes_ = Counter(np.asarray(topic_model.topics_)[doc_codes].tolist())
+
+
+def stratified_sample(strata, size, seed=42):
+    '''Sorted positions of a sample of about size elements, drawn from every stratum in proportion to its size.'''
+    strata = pd.Series(np.asarray(strata))
+    sample = strata.groupby(strata).sample(frac=size / len(strata), random_state=seed)
+    return np.sort(sample.index.to_numpy())
+
+
+def assign_topics(model, docs, embeddings, fitted_positions, batch_size=TRANSFORM_BATCH_SIZE):
+    '''Topics of all docs: the ones the model was fitted on keep their topic, the others are assigned with the fitted model in batches.'''
+    topics = np.full(len(docs), -1)
+    topics[fitted_positions] = model.topics_
+
+    remaining = np.setdiff1d(np.arange(len(docs)), fitted_positions)
+    for start in tqdm(range(0, len(remaining), batch_size)):
+        batch = remaining[start:start + batch_size]
+        batch_topics, _ = model.transform([docs[i] for i in batch], embeddings[batch])
+        topics[batch] = batch_topics
+    return topics.tolist()
+
+
+def fit_topics(docs, embeddings, strata=None, sample_size=None):
+    '''Fits a copy of the topic model pipeline below, on all docs or on a stratified sample of them, and returns the topics of all docs after outlier reduction.'''
+    model = BERTopic(embedding_model=embedding_model, umap_model=clone(umap_model), hdbscan_model=clone(hdbscan_model), 
+                     vectorizer_model=clone(vectorizer_model), representation_model=representation_model, top_n_words=10)
+
+    if sample_size is None or sample_size >= len(docs):
+        topics, _ = model.fit_transform(docs, embeddings)
+    else:
+        positions = stratified_sample(strata, sample_size)
+        model.fit([docs[i] for i in positions], embeddings[positions])
+        topics = assign_topics(model, docs, embeddings, positions)
+
+    return np.asarray(model.reduce_outliers(docs, topics, strategy='embeddings', embeddings=embeddings))
+
+
+def restore_representative_docs(topic_model):
+    '''Replaces the document IDs that BERTopic saw after fitting (see DocumentTermVectorizer) with their texts among the representative documents.'''
+    topic_model.representative_docs_ = {topic: [fit_docs[int(doc)] if doc.isdigit() else doc for doc in docs] 
+                                        for topic, docs in topic_model.representative_docs_.items()}
+
+
+def topic_agreement(topics_a, topics_b):
+    '''Prints how far two topic assignments of the same tweets agree (topic IDs may differ between fits).'''
+    print(f'Adjusted Rand index: {adjusted_rand_score(topics_a, topics_b):.3f}')
+    print(f'Normalized mutual information: {normalized_mutual_info_score(topics_a, topics_b):.3f}')
+
 
+# %%
 # Preventing stochastic behavior
 umap_model = UMAP(n_neighbors=15, n_components=5, min_dist=0.0, metric='cosine', random_state=42)
 
@@ -74,7 +214,49 @@ topic_model = BERTopic(
 )
 
 # Train model
-topics, probs = topic_model.fit_transform(df_text_clean, embeddings)
+# NOTE: With FIT_SAMPLE_SIZE, the model is fitted on a stratified sample and the other documents are assigned to its topics in batches
+if FIT_SAMPLE_SIZE is None or FIT_SAMPLE_SIZE >= len(fit_docs):
+    topics, probs = topic_model.fit_transform(fit_docs, fit_embeddings)
+else:
+    sample_positions = stratified_sample(fit_strata, FIT_SAMPLE_SIZE)
+    topic_model.fit([fit_docs[i] for i in sample_positions], fit_embeddings[sample_positions])
+    topics = assign_topics(topic_model, fit_docs, fit_embeddings, sample_positions)
+
+
+# %%
+# Compare the topics of the dedup mode with a full fit (duplicates included) on a sample of tweets
+if BENCHMARK and DEDUP_DOCUMENTS:
+    sample_rows = np.sort(np.random.default_rng(42).choice(len(df_text_clean), size=min(AGREEMENT_SAMPLE, len(df_text_clean)), replace=False))
+    sample_codes, sample_docs = pd.factorize(df['text_clean'].iloc[sample_rows])
+    sample_first = np.unique(sample_codes, return_index=True)[1]
+
+    start = time.perf_counter()
+    topics_full = fit_topics(df['text_clean'].iloc[sample_rows].tolist(), embeddings[sample_rows])
+    print(f'Full fit: {len(sample_rows):,} documents in {time.perf_counter() - start:,.0f} s')
+
+    start = time.perf_counter()
+    topics_dedup = fit_topics(sample_docs.tolist(), embeddings[sample_rows][sample_first])[sample_codes]
+    print(f'Dedup fit: {len(sample_docs):,} documents in {time.perf_counter() - start:,.0f} s')
+
+    topic_agreement(topics_full, topics_dedup)
+
+
+# %%
+# Compare the topics of the sample-fit mode with a full fit on a sample of documents
+if BENCHMARK and FIT_SAMPLE_SIZE is not None:
+    sample_positions = np.sort(np.random.default_rng(42).choice(len(fit_docs), size=min(AGREEMENT_SAMPLE, len(fit_docs)), replace=False))
+    sample_docs = [fit_docs[i] for i in sample_positions]
+    sample_size = int(len(sample_positions) * FIT_SAMPLE_SIZE / len(fit_docs))  # NOTE: The same sampling fraction as in the real fit
+
+    start = time.perf_counter()
+    topics_full = fit_topics(sample_docs, fit_embeddings[sample_positions])
+    print(f'Full fit: {len(sample_positions):,} documents in {time.perf_counter() - start:,.0f} s')
+
+    start = time.perf_counter()
+    topics_sampled = fit_topics(sample_docs, fit_embeddings[sample_positions], fit_strata.iloc[sample_positions], sample_size=sample_size)
+    print(f'Sample fit: {sample_size:,} of {len(sample_positions):,} documents in {time.perf_counter() - start:,.0f} s')
+
+    topic_agreement(topics_full, topics_sampled)
 
 
 # %%
@@ -93,11 +275,24 @@ pd.set_option('display.max_rows', None)
 topic_model.get_topic_info()
 
 
+# %%
+# Document-term matrix of the documents (1-3-grams as in vectorizer_model), computed once or loaded from DTM_PATH
+# NOTE: From here on BERTopic gets document IDs (dtm_docs) instead of texts, and dtm_vectorizer counts their terms from the matrix
+# instead of running the CountVectorizer over the corpus again in every step. In DEDUP_DOCUMENTS mode each text counts as often as it was tweeted
+dtm_vectorizer = DocumentTermVectorizer.from_documents(fit_docs, path=DTM_PATH, min_df=10, weights=fit_weights, stop_words='english', ngram_range=(1, 3))
+dtm_docs = dtm_vectorizer.document_ids()
+dtm_vectorizer.check_preprocessing(topic_model._preprocess_text)  # NOTE: Fails loudly if this BERTopic version alters the IDs
+
+
 # %%
 # Reduce outliers using the `embeddings` strategy
-topics = topic_model.reduce_outliers(df_text_clean, topics, strategy="embeddings", embeddings=embeddings)
+topics = topic_model.reduce_outliers(dtm_docs, topics, strategy="embeddings", embeddings=fit_embeddings)
 
-topic_model.update_topics(df_text_clean, topics=topics, vectorizer_model=vectorizer_model)
+if BENCHMARK:
+    topic_model_before_update, topics_before_update = copy.deepcopy(topic_model), topics
+
+topic_model.update_topics(dtm_docs, topics=topics, vectorizer_model=dtm_vectorizer)
+count_all_tweets(topic_model)
 
 
 # %%
@@ -111,7 +306,7 @@ topic_info.to_csv(BERTOPIC_RESULTS_PATH + 'topic_info.csv', index=False)
 
 # %%
 # Hierarchical Clustering
-hierarchical_topics = topic_model.hierarchical_topics(df_text_clean)
+hierarchical_topics = topic_model.hierarchical_topics(dtm_docs)
 
 fig_hc = topic_model.visualize_hierarchy(hierarchical_topics=hierarchical_topics)
 fig_hc
@@ -122,14 +317,18 @@ fig_hc.write_html(BERTOPIC_RESULTS_PATH + 'hierarchical_clustering_topics_before
 
 # %%
 # Merge topics: Russia-Ukraine with 'Gas Oil Russian Energy', 'Germany German Ukraine Russia' (about weapon delivery), 'Moldova, Ukraine, Moldova, Romania' (Ukraine EU status), 'Refugees Ukraine Ukrainian fleeing' and a topic that was attested close relationship to Russia-Ukraine in the hierarchical clustering: 'war and peace'
+# NOTE: The IDs are those of the full fit (DEDUP_DOCUMENTS and FIT_SAMPLE_SIZE off); check the names printed below after refitting in another mode
 topics_to_merge = [0, 13, 44, 45, 47, 49]
+print(topic_model.get_topic_info().set_index('Topic').loc[topics_to_merge, 'Name'])
 
-topic_model.merge_topics(df_text_clean, topics_to_merge)
+topic_model.merge_topics(dtm_docs, topics_to_merge)
+count_all_tweets(topic_model)
+restore_representative_docs(topic_model)
 
 
 # %%
 # Hierarchical Clustering
-hierarchical_topics = topic_model.hierarchical_topics(df_text_clean)
+hierarchical_topics = topic_model.hierarchical_topics(dtm_docs)
 
 fig_hc = topic_model.visualize_hierarchy(hierarchical_topics=hierarchical_topics)
 fig_hc
@@ -139,8 +338,8 @@ fig_hc.write_html(BERTOPIC_RESULTS_PATH + 'hierarchical_clustering_topics_after_
 
 
 # %%
-# Update topics
-topics = topic_model.topics_
+# Update topics (mapped back to every tweet)
+topics = np.asarray(topic_model.topics_)[doc_codes].tolist()
 
 # Show frequent topics
 topic_info = topic_model.get_topic_info()
@@ -149,6 +348,12 @@ print(topic_info)
 # Save the table to a CSV file
 topic_info.to_csv(BERTOPIC_RESULTS_PATH + 'topic_info_after_merging.csv', index=False)
 
+# Save the merged model, used by topic_classifier.py to assign topics to new tweets
+# NOTE: Saved with a CountVectorizer of the same vocabulary, as dtm_vectorizer only works on the document IDs of this run
+topic_model.vectorizer_model = dtm_vectorizer.to_count_vectorizer()
+topic_model.save(BERTOPIC_RESULTS_PATH + 'bertopic_model_merged')
+topic_model.vectorizer_model = dtm_vectorizer
+
 
 # %%
 # Define custom names for the top 10 topics to appear in the graph
@@ -179,11 +384,14 @@ df['created_at'] = pd.to_datetime(df['created_at'])
 # Make unique timestamps per week per tweet
 timestamps = df['created_at'].dt.to_period('W').dt.to_timestamp()
 
-# Extract the cleaned text data from the DataFrame as a list of strings
-documents = df['text_clean'].tolist()
+# Document ID of every tweet (see DocumentTermVectorizer)
+documents = [dtm_docs[code] for code in doc_codes]
+
+# Topic × day × slice × term counts, built once; any granularity and slice of the topics over time is summed from it
+topic_time_cube = TopicTimeCube(topic_model, dtm_vectorizer, doc_codes, topics, df['created_at'], slices=df[TIME_SLICES])
 
 # Generate topics over time
-topics_over_time = topic_model.topics_over_time(documents, timestamps.to_list())
+topics_over_time = topic_time_cube.topics_over_time('W')
 
 # Visualization of all topics over time
 fig_all_topics = topic_model.visualize_topics_over_time(topics_over_time)
@@ -220,6 +428,62 @@ fig_all_topics.show()
 fig_all_topics.write_image(BERTOPIC_RESULTS_PATH + 'all_topics_over_time.png')
 
 
+# %%
+# Compare the time spent after fitting with texts and a CountVectorizer, and with the document-term matrix
+def post_process(topic_model, docs, tweet_docs, vectorizer):
+    '''Runs the steps after fitting (as above) on a copy of the model and returns its topics over time.'''
+    topic_model = copy.deepcopy(topic_model)
+    topic_model.update_topics(docs, topics=topics_before_update, vectorizer_model=vectorizer)
+    topic_model.hierarchical_topics(docs)
+    topic_model.merge_topics(docs, topics_to_merge)
+    topic_model.hierarchical_topics(docs)
+    return topic_model.topics_over_time(tweet_docs, timestamps.to_list(), topics=np.asarray(topic_model.topics_)[doc_codes].tolist())
+
+if BENCHMARK:
+    start = time.perf_counter()
+    topics_over_time_texts = post_process(topic_model_before_update, fit_docs, df['text_clean'].tolist(), clone(vectorizer_model))
+    print(f'After fitting with texts: {time.perf_counter() - start:,.0f} s')
+
+    start = time.perf_counter()
+    topics_over_time_dtm = post_process(topic_model_before_update, dtm_docs, documents, copy.copy(dtm_vectorizer))
+    print(f'After fitting with the document-term matrix: {time.perf_counter() - start:,.0f} s')
+
+    # NOTE: The counts only differ by the n-grams that span two joined documents, so the frequencies should match
+    print('Same topics over time:', topics_over_time_texts[['Topic', 'Frequency', 'Timestamp']].equals(topics_over_time_dtm[['Topic', 'Frequency', 'Timestamp']]))
+
+
+# %%
+# Compare the topics over time from the cube with BERTopic's topics_over_time
+if BENCHMARK:
+    start = time.perf_counter()
+    topics_over_time_bertopic = topic_model.topics_over_time(documents, timestamps.to_list(), topics=topics)
+    print(f'BERTopic topics_over_time: {time.perf_counter() - start:,.1f} s')
+
+    for freq in ['D', 'W', 'M']:
+        start = time.perf_counter()
+        topic_time_cube.topics_over_time(freq)
+        print(f'Cube topics over time ({freq}): {time.perf_counter() - start:,.1f} s')
+
+    comparison = topics_over_time_bertopic.merge(topics_over_time, on=['Topic', 'Timestamp'], how='outer', suffixes=('_bertopic', '_cube'))
+    print('Same frequencies:', (comparison['Frequency_bertopic'] == comparison['Frequency_cube']).all())
+    # NOTE: Both count the terms with dtm_vectorizer and refine them with topic_model.representation_model, so the words should only
+    # differ where c-TF-IDF values tie
+    print(f"Same words: {(comparison['Words_bertopic'] == comparison['Words_cube']).mean():.1%} of topics and weeks")
+
+
+# %%
+# Topics over time per day and month, and per week by EU party group and country
+for freq, name in [('D', 'daily'), ('W', 'weekly'), ('M', 'monthly')]:
+    topic_time_cube.topics_over_time(freq).to_csv(BERTOPIC_RESULTS_PATH + f'topics_over_time_{name}.csv', index=False)
+
+for column in TIME_SLICES:
+    topic_time_cube.topics_over_time('W', by=column).to_csv(BERTOPIC_RESULTS_PATH + f'topics_over_time_weekly_by_{column}.csv', index=False)
+
+# Topic frequencies per day around the Russian invasion (2022-02-24), by EU party group
+frequencies = topic_time_cube.frequencies('D', by='eu_party_group')
+frequencies[frequencies['Timestamp'].between('2022-02-10', '2022-03-10')]
+
+
 # %%
 # Add topic number to df and select topics
 df['topic'] = topics
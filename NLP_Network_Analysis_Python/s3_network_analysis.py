@@ -1,11 +1,27 @@
 # %%
+import numpy as np
+import os
 import pandas as pd
 
+from network_edges import as_ns, create_nodes, mention_edges, retweet_edges, retweet_stream, sliding_windows, window_bounds
+from temporal_network import TemporalNetwork
+from weighted_graph import WeightedGraph
 
-DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  
-PERIOD_1_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/period_1/'
-PERIOD_2_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/period_2/'
-ALL_PERIODS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/all_periods/'
+
+DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'
+RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/'
+PERIOD_1_PATH = RESULTS_PATH + 'period_1/'
+PERIOD_2_PATH = RESULTS_PATH + 'period_2/'
+ALL_PERIODS_PATH = RESULTS_PATH + 'all_periods/'
+
+WRITE_CSV = True  # NOTE: get_data in s5 reads the edges.csv and nodes.csv pair; s5 writes it from the graph files if it is missing
+
+# Temporal network
+TEMPORAL = False  # NOTE: Set to True to compute statistics of the retweet network in windows sliding over the whole period
+TEMPORAL_WINDOW_DAYS = 7  # NOTE: Length of the sliding windows
+TEMPORAL_STEP_DAYS = 1  # NOTE: Days the window moves forward at a time
+TEMPORAL_COMMUNITIES = False  # NOTE: Set to True to also detect Louvain communities in each window (rebuilds each window's graph from the current weights)
+TEMPORAL_RESOLUTION = 1.0  # NOTE: Resolution of the Louvain community detection
 
 
 # Define Periods
@@ -18,120 +34,74 @@ end_date_period_2 = '2022-07-22'
 start_date_all_periods = '2021-10-13'
 end_date_all_periods = '2022-07-22'
 
+# Windows to build networks for: (name, start date, end date, results path), both dates included
+# NOTE: Windows may overlap, and more can be added (e.g. with sliding_windows) without joining the retweets again
+WINDOWS = [
+    ('period_1', start_date_period_1, end_date_period_1, PERIOD_1_PATH),
+    ('period_2', start_date_period_2, end_date_period_2, PERIOD_2_PATH),
+    ('all_periods', start_date_all_periods, end_date_all_periods, ALL_PERIODS_PATH),
+]
+
 
 # %%
 # Load data
 df = pd.read_feather(DATA_PATH + 'bigsss_tweets_w_topic.feather')
 
 # Create russo-ukraine data frame with only tweets containing this topic
-df_rus_ukr = df.loc[(df['russo_ukraine']==1)]  
+df_rus_ukr = df.loc[(df['russo_ukraine']==1)]
 
 #df_rus_ukr.to_feather(DATA_PATH + 'bigsss_tweets_ukraine_only.feather')
 
 
 # %%
-# Split tweets with topics according to the periods
-period_1 = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_period_1) & (df_rus_ukr['created_at'] <= end_date_period_1)]
-period_2 = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_period_2) & (df_rus_ukr['created_at'] <= end_date_period_2)]
-all_periods = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_all_periods) & (df_rus_ukr['created_at'] <= end_date_all_periods)]
-
-
-# %%
-# Keep retweets ONLY and create nodes and edges 
-# Period 1 
-retweets_period_1 = period_1[period_1['action'] == 'retweeted']
-
-# Period 2
-retweets_period_2 = period_2[period_2['action'] == 'retweeted']
-
-# All periods
-retweets_all_periods = all_periods[all_periods['action'] == 'retweeted']
-
-
-# Convert retweet IDs to str
-# Period 1
-retweets_period_1['action_id'] = retweets_period_1['action_id'].astype(str)
-
-# Period 2
-retweets_period_2['action_id'] = retweets_period_2['action_id'].astype(str)
-
-# All periods
-retweets_all_periods['action_id'] = retweets_all_periods['action_id'].astype(str)
-
-
-# Merge the two data frames, in order to find all retweets among MPs
-# Period 1
-retweets_period_1_merged = pd.merge(retweets_period_1, period_1, left_on='action_id', right_on='id', 
-                                    suffixes=('_retweet', '_original'))
-
-# Period 2
-retweets_period_2_merged = pd.merge(retweets_period_2, period_2, left_on='action_id', right_on='id', 
-                                    suffixes=('_retweet', '_original'))
-
-# All periods
-retweets_all_periods_merged = pd.merge(retweets_all_periods, all_periods, left_on='action_id', right_on='id', 
-                                        suffixes=('_retweet', '_original'))
+# Create edges and nodes of all windows
+edges = retweet_edges(df_rus_ukr, WINDOWS)
+nodes = {name: create_nodes(edges[name]) for name in edges}
 
+# Weighted graphs with the same node numbering, parallel edges aggregated into weights
+graphs = {name: WeightedGraph.from_edges(edges[name], nodes[name]['label']) for name in edges}
 
-# Create edges
-# Period 1
-edges_period_1 = retweets_period_1_merged[['user_id_retweet', 'user_id_original']]
-edges_period_1 = edges_period_1.rename(columns={'user_id_retweet': 'source', 'user_id_original': 'target'})
-
-# Remove edges where users retweet themselves
-edges_period_1 = edges_period_1[edges_period_1['source'] != edges_period_1['target']]
-
-
-# Period 2
-edges_period_2 = retweets_period_2_merged[['user_id_retweet', 'user_id_original']]
-edges_period_2 = edges_period_2.rename(columns={'user_id_retweet': 'source', 'user_id_original': 'target'})
-
-# Remove edges where users retweet themselves
-edges_period_2 = edges_period_2[edges_period_2['source'] != edges_period_2['target']]
-
-# All periods
-edges_all_periods = retweets_all_periods_merged[['user_id_retweet', 'user_id_original']]
-edges_all_periods = edges_all_periods.rename(columns={'user_id_retweet': 'source', 'user_id_original': 'target'})
-
-# Remove edges where users retweet themselves
-edges_all_periods = edges_all_periods[edges_all_periods['source'] != edges_all_periods['target']]
-
-
-# Create nodes
-# Period 1
-unique_nodes_period_1 = pd.unique(edges_period_1[['source', 'target']].values.ravel('K'))
-
-nodes_period_1 = pd.DataFrame({'label': unique_nodes_period_1})
-nodes_period_1.insert(0, 'id', range(1, len(nodes_period_1) + 1))  # Add 'id' column
-
-# Period 2
-unique_nodes_period_2 = pd.unique(edges_period_2[['source', 'target']].values.ravel('K'))
-
-nodes_period_2 = pd.DataFrame({'label': unique_nodes_period_2})
-nodes_period_2.insert(0, 'id', range(1, len(nodes_period_2) + 1))  # Add 'id' column
-
-# All periods
-unique_nodes_all_periods = pd.unique(edges_all_periods[['source', 'target']].values.ravel('K'))
-
-nodes_all_periods = pd.DataFrame({'label': unique_nodes_all_periods})
-nodes_all_periods.insert(0, 'id', range(1, len(nodes_all_periods) + 1))  # Add 'id' column
-
+# Mention networks of all windows, in the same format
+mention_graphs = {name: WeightedGraph.from_edges(window_edges) for name, window_edges in mention_edges(df_rus_ukr, WINDOWS).items()}
 
 
 # %%
-# Save edges and nodes 
-# Period 1
-edges_period_1.to_csv(PERIOD_1_PATH + 'edges.csv', index=False)
-nodes_period_1.to_csv(PERIOD_1_PATH + 'nodes.csv', index=False)
+# Save the graphs, and the edges and nodes
+for name, _, _, path in WINDOWS:
+    os.makedirs(path, exist_ok=True)
+    graphs[name].save(path)
+    mention_graphs[name].save(path, name='mention')
+    if WRITE_CSV:
+        edges[name].to_csv(path + 'edges.csv', index=False)
+        nodes[name].to_csv(path + 'nodes.csv', index=False)
 
-# Period 2
-edges_period_2.to_csv(PERIOD_2_PATH + 'edges.csv', index=False)
-nodes_period_2.to_csv(PERIOD_2_PATH + 'nodes.csv', index=False)
-
-# All periods
-edges_all_periods.to_csv(ALL_PERIODS_PATH + 'edges.csv', index=False)
-nodes_all_periods.to_csv(ALL_PERIODS_PATH + 'nodes.csv', index=False)
 
+# %%
+# Retweet network in windows sliding over the whole period, updated incrementally from one window to the next
+# NOTE: A retweet is in a window if the retweet and the original tweet both are, as in the windows above
+if TEMPORAL:
+    stream = retweet_stream(df_rus_ukr)
+    temporal_windows = sliding_windows(start_date_all_periods, end_date_all_periods, length=TEMPORAL_WINDOW_DAYS, step=TEMPORAL_STEP_DAYS, path=RESULTS_PATH)
+    starts, ends = window_bounds(temporal_windows, stream['created_at_retweet'].dt.tz)
+
+    network = TemporalNetwork(stream['user_id_retweet'], stream['user_id_original'],
+                              first=np.minimum(as_ns(stream['created_at_retweet']), as_ns(stream['created_at_original'])),
+                              last=np.maximum(as_ns(stream['created_at_retweet']), as_ns(stream['created_at_original'])))
+
+    temporal_statistics, degree_distributions = [], []
+    for (name, window_start, window_end, _), _ in zip(temporal_windows, network.run(starts, ends)):
+        window_statistics = {'window': name, 'start': window_start, 'end': window_end, **network.statistics()}
+        if TEMPORAL_COMMUNITIES and network.number_of_edges > 0:
+            window_statistics['number_of_communities'] = len(np.unique(network.communities(TEMPORAL_RESOLUTION)))
+        temporal_statistics.append(window_statistics)
+
+        degree_counts = network.degree_distribution()
+        degree_distributions.append(pd.DataFrame({'window': name, 'degree': np.arange(len(degree_counts)), 'nodes': degree_counts}))
+
+    temporal_statistics = pd.DataFrame(temporal_statistics)
+    temporal_statistics.to_csv(RESULTS_PATH + f'temporal_network_{TEMPORAL_WINDOW_DAYS}d_statistics.csv', index=False)
+    pd.concat(degree_distributions, ignore_index=True).query('nodes > 0').to_csv(RESULTS_PATH + f'temporal_network_{TEMPORAL_WINDOW_DAYS}d_degrees.csv', index=False)
+    print(temporal_statistics)
 
 
 # %%
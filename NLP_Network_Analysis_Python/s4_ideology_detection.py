@@ -1,22 +1,37 @@
 
 # %% 
-import pandas as pd
 import numpy as np
+import pandas as pd
 import sys
 
 sys.path.insert(1, '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine') # adjust if necessary
 
+from bert_preprocessing import PreprocessCache
+from embedding_store import EmbeddingStore
 from sentence_transformers import SentenceTransformer
-from src.tweet_preprocessing import preprocess_tweet_for_bert
-
-from tqdm import tqdm
-
-tqdm.pandas()
+from tweet_selection import author_offsets, group_tweets, original_tweets, select_tweets, tweets_in_periods
+from user_embeddings import period_embeddings
 
 DATA_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/data/'  
 PERIOD_1_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/period_1/'
 PERIOD_2_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/period_2/'
 ALL_PERIODS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/all_periods/'
+EMBEDDINGS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/embeddings/'  # NOTE: Embedding store shared with s2
+
+EMBEDDING_DTYPE = 'float32'  # NOTE: 'float16' halves the size of the embedding store
+ENCODE_BATCH_SIZE = 64  # NOTE: Batch size of the encoding of all tweets
+USER_EMBEDDING_DTYPE = 'float32'  # NOTE: 'float16' halves the size of the user embedding matrices
+WRITE_EMBEDDINGS_FEATHER = True  # NOTE: get_data in s5 reads embeddings.feather (one array per user), next to the user embedding matrix
+MAX_TWEETS = 200  # NOTE: Maximum number of tweets per author and period
+TWEET_SAMPLING = 'first'  # NOTE: 'first' keeps each author's earliest MAX_TWEETS tweets of a period, 'reservoir' a uniform random sample of them
+SAMPLING_SEED = 42
+WRITE_GROUPED_TWEETS = True  # NOTE: get_data in s5 reads tweets.feather (one array of tweets per author), next to the flat tweets table
+
+# Parallel preprocessing
+PREPROCESS_WORKERS = 1  # NOTE: Number of processes used to preprocess tweets, 1 preprocesses them serially in this process
+PREPROCESS_CHUNK_SIZE = 5_000  # NOTE: Number of tweets handed to a worker at a time
+PREPROCESS_CACHE_PATH = None  # NOTE: e.g. DATA_PATH + 'preprocess_cache.feather' to keep preprocessed tweets across runs; None keeps them for this run only
+
 
 SENTENCE_MODEL = 'all-mpnet-base-v2' # The default is: 'all-MiniLM-L6-v2'
 
@@ -36,6 +51,14 @@ end_date_period_2 = '2022-07-22'
 start_date_all_periods = '2021-10-13'
 end_date_all_periods = '2022-07-22'
 
+# Periods to compute embeddings for: (name, start date, end date, results path), both dates included
+# NOTE: All tweets are encoded once, so more (overlapping or sliding) periods only add an aggregation each
+PERIODS = [
+    ('period_1', start_date_period_1, end_date_period_1, PERIOD_1_PATH),
+    ('period_2', start_date_period_2, end_date_period_2, PERIOD_2_PATH),
+    ('all_periods', start_date_all_periods, end_date_all_periods, ALL_PERIODS_PATH),
+]
+
 
 # %%
 # Load data
@@ -50,86 +73,61 @@ df_rus_ukr = df.loc[(df['russo_ukraine']==1)]
 
 
 # %%
-# rename user_id to author_id for the rest of the analysis
-df_rus_ukr = df_rus_ukr.rename(columns={'user_id': 'author_id'})
-
-# NOTE: Keep original tweets ONLY (not retweets) 
-df_rus_ukr = df_rus_ukr[~df_rus_ukr['action'].isin(['retweeted'])]
-
-# Keep certain columns
-df_rus_ukr = df_rus_ukr[['author_id', 'text_translated', 'created_at']]  
-
-# Rename columns
-df_rus_ukr = df_rus_ukr.rename(columns={'author_id': 'author_id', 'text_translated': 'tweets'})  
-
-# Convert tweets to str
-df_rus_ukr['tweets'] = df_rus_ukr['tweets'].astype(str)  
+# Keep the original tweets (not retweets) of the authors, with their translated text
+df_rus_ukr = original_tweets(df_rus_ukr)
 
 
 # %%
 # Split tweets with topics according to the periods
 # NOTE: Ideology detection (& embeddings computation) is done on Russo-Ukraine tweets for the respective period (before, after, all) --> TO DO: Clarify whether ideology should be computed on all tweets (not only those mentioning Russo-Ukraine) & or on all Tweets mentionings Russo-Ukraine
 
-period_1 = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_period_1) & (df_rus_ukr['created_at'] <= end_date_period_1)]
-period_2 = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_period_2) & (df_rus_ukr['created_at'] <= end_date_period_2)]
-all_periods = df_rus_ukr[(df_rus_ukr['created_at'] >= start_date_all_periods) & (df_rus_ukr['created_at'] <= end_date_all_periods)]
+# Tweets of all periods, sorted by author and time, so that each period's tweets of an author are consecutive
+period_tweets = tweets_in_periods(df_rus_ukr, PERIODS)
 
 
 # %%
-# Group by author_id and convert to array and truncate tweets to a maximum of 200 per author_id
-
-def process_period(df):
-    df_grouped = df.groupby('author_id')['tweets'].apply(list).reset_index()
-    df_grouped['tweets'] = df_grouped['tweets'].apply(lambda x: np.array(x[:200]))
-    return df_grouped
+# Select at most MAX_TWEETS tweets per author and period
 
-period_1_grouped = process_period(period_1)
-period_2_grouped = process_period(period_2)
-all_periods_grouped = process_period(all_periods)
+period_selections = {name: select_tweets(period_tweets, start, end, MAX_TWEETS, TWEET_SAMPLING, SAMPLING_SEED) for name, start, end, _ in PERIODS}
 
 
 # %%
 # Save tweets for ideology detection to all sub-folders
-period_1_grouped.to_feather(PERIOD_1_PATH + 'tweets.feather')  
-period_2_grouped.to_feather(PERIOD_2_PATH + 'tweets.feather')  
-all_periods_grouped.to_feather(ALL_PERIODS_PATH + 'tweets.feather')
+for name, _, _, path in PERIODS:
+    period_selections[name].drop(columns='row').to_feather(path + 'tweets_flat.feather')
+    author_offsets(period_selections[name]).to_feather(path + 'tweet_authors.feather')
+    if WRITE_GROUPED_TWEETS:
+        group_tweets(period_selections[name]).to_feather(path + 'tweets.feather')
 
 
 # %%
 # Compute embeddings for each period
-def compute_embeddings(df_grouped, path):
-    def preprocess_tweets(tweets):
-        out = []
-        for tw in tweets:
-            tw = preprocess_tweet_for_bert(tw)
-            if len(tw) > 1:
-                out.append(" ".join(tw))
-        return out
-
-    df_grouped["tweets"] = df_grouped["tweets"].progress_apply(preprocess_tweets)
-
-    # Remove users with no tweets
-    df_grouped = df_grouped[df_grouped["tweets"].apply(len) > 0]
-
-    model = SentenceTransformer(SENTENCE_MODEL)
-
-    def embed_user_tweets(tweets):
-        emb = model.encode(tweets)
-        emb = np.mean(emb, axis=0)
-        return emb
-
-    df_grouped["embeddings"] = df_grouped["tweets"].progress_apply(embed_user_tweets)
-
-    embeddings_tmp = df_grouped[["author_id", "embeddings"]]
-    embeddings_tmp.reset_index(drop=True, inplace=True)
-
-    # Save embeddings to the specified path
-    embeddings_tmp.to_feather(path + "embeddings.feather")
+# Multi-period mode: preprocess and encode every tweet of the periods once, then average the embeddings per period and author
+# NOTE: Tweets that are already in the embedding store (e.g. from earlier runs) are read from it instead of encoded
+embedding_store = EmbeddingStore(EMBEDDINGS_PATH, SENTENCE_MODEL, dtype=EMBEDDING_DTYPE)
+model = SentenceTransformer(SENTENCE_MODEL)
+
+# Preprocess the tweets selected for any period, each distinct tweet once (see PreprocessCache)
+selected = np.unique(np.concatenate([tweets['row'].to_numpy() for tweets in period_selections.values()]))
+preprocess_cache = PreprocessCache(PREPROCESS_CACHE_PATH, PREPROCESS_WORKERS, PREPROCESS_CHUNK_SIZE)
+preprocessed = pd.Series(None, index=range(len(period_tweets)), dtype=object)
+preprocessed.iloc[selected] = preprocess_cache.preprocess(period_tweets['tweets'].iloc[selected])
+preprocess_cache.report()
+preprocess_cache.save()
+
+valid = preprocessed.notna().to_numpy()  # NOTE: Tweets of one token or less are dropped (see preprocess_texts)
+
+# Tweet-level embedding matrix (zero for the dropped tweets)
+encoded = embedding_store.encode(preprocessed[valid].tolist(), lambda texts: model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True))
+tweet_embeddings = np.zeros((len(period_tweets), encoded.shape[1] if len(encoded) else 0), dtype=np.float32)
+tweet_embeddings[valid] = encoded
 
 # Compute and save embeddings for each period
-compute_embeddings(period_1_grouped, PERIOD_1_PATH)
-compute_embeddings(period_2_grouped, PERIOD_2_PATH)
-compute_embeddings(all_periods_grouped, ALL_PERIODS_PATH)
+for name, _, _, path in PERIODS:
+    user_embeddings = period_embeddings(period_selections[name], tweet_embeddings, valid)
+    user_embeddings.save(path, dtype=USER_EMBEDDING_DTYPE)
+    if WRITE_EMBEDDINGS_FEATHER:
+        user_embeddings.to_frame().to_feather(path + "embeddings.feather")
 
+embedding_store.report()
 
-# %%
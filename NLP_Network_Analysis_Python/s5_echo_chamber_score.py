@@ -6,7 +6,11 @@
 #import os
 #os.environ["CUBLAS_WORKSPACE_CONFIG"]=":4096:8"
 
+import itertools
 import json
+import multiprocessing
+import os
+import time
 import torch
 import random
 import numpy as np
@@ -19,22 +23,28 @@ sys.path.insert(1, '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/') # a
 from src.load_data import get_data
 from src.EchoGAE import EchoGAE_algorithm
 from src.echo_chamber_measure import EchoChamberMeasure
+from user_embeddings import UserEmbeddings
+from weighted_graph import WeightedGraph
 
 
 # %%
 seed_value=42
-random.seed(seed_value)
-np.random.seed(seed_value)
-torch.manual_seed(seed_value)
-torch.cuda.manual_seed(seed_value)
-torch.cuda.manual_seed_all(seed_value)
-#torch.backends.cudnn.enabled=True
-#torch.backends.cudnn.benchmark=False
-#torch.backends.cudnn.deterministic=True
-#torch.use_deterministic_algorithms(True)
-check_random_state(seed_value)
-
-# NOTE: Yu need to calculate the ECS for each period individually, i.e., add and remove # for the specific periods you are interested in
+
+def set_seeds(seed_value):
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+    torch.manual_seed(seed_value)
+    torch.cuda.manual_seed(seed_value)
+    torch.cuda.manual_seed_all(seed_value)
+    #torch.backends.cudnn.enabled=True
+    #torch.backends.cudnn.benchmark=False
+    #torch.backends.cudnn.deterministic=True
+    #torch.use_deterministic_algorithms(True)
+    check_random_state(seed_value)
+
+set_seeds(seed_value)
+
+# NOTE: Yu need to calculate the ECS for each period individually, i.e., add and remove # for the specific periods you are interested in, or set BATCH below to compute all of them in one run
 
 # Datasets 
 # Period 1
@@ -54,85 +64,249 @@ MIN_DEGREE = 0  # NOTE: Minimum degree each node should have in given RT network
 MIN_TWEETS = 2  # NOTE: Minimum number of tweets posted in given period
 
 
-# ECS metric
-ecs_information = []
+# Parameter sweep
+SWEEP = False  # NOTE: Set to True to compute the ECS for every combination of the filters in SWEEP_GRID (before the run with the filters above)
+SWEEP_GRID = {
+    'res_value': [0.05, 0.1, 0.2, 0.5, 1.0],
+    'comm_size': [3, 5, 10],
+    'min_degree': [0, 1, 2],
+    'min_tweets': [1, 2, 5],
+}
+SWEEP_WORKERS = 4  # NOTE: Number of processes evaluating combinations, 1 evaluates them serially in this process
+
+
+# Batch of datasets
+RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/results/'
+BATCH = False  # NOTE: Set to True to compute the ECS for every dataset in BATCH_DATASETS with the filters above, instead of ds only
+BATCH_DATASETS = [
+    RESULTS_PATH + 'period_1/',
+    RESULTS_PATH + 'period_2/',
+    RESULTS_PATH + 'all_periods/',
+]  # NOTE: Any directory with the graph of s3 and the user embeddings of s4, e.g. a window of sliding_windows that is in both WINDOWS (s3) and PERIODS (s4)
+BATCH_WORKERS = 3  # NOTE: Number of processes computing datasets, 1 computes them serially in this process
+BATCH_SUMMARY_PATH = RESULTS_PATH + f'ecs_summary_resolution_{RES_VALUE}.csv'
+
+
+# %%
+def compute_ecs(path, resolution, min_comm_size, min_degree, min_tweets, graph=None, min_communities=0):
+    '''Computes the Echo Chamber Score of the dataset in path with the given filters.
+
+    Returns the ECS information (a row of ecs_information, with the size of the weighted retweet graph if it is given),
+    users_information, the community labels and the author_id to index map. With fewer than min_communities
+    communities, a ValueError is raised before EchoGAE is trained.
+    '''
+    ds_dict = {}
+    ds_dict["dataset"] = path
+
+    # Get the data
+    # NOTE: See https://github.com/pyg-team/pytorch_geometric/issues/92
+    G, users_embeddings, community_labels, author_id_to_index_map, users_information = get_data(path=f"{path}", 
+                                                                                              resolution=resolution, 
+                                                                                              min_comm_size=min_comm_size,
+                                                                                              directed_graph=True, # TO DO: decide whether directed or undirected
+                                                                                              min_degree=min_degree,
+                                                                                              min_tweets=min_tweets)
+
+    # Graph information
+    if graph is not None:
+        ds_dict["number_of_retweets"] = int(graph.adjacency.sum())
+        ds_dict["number_of_weighted_edges"] = graph.number_of_edges()
+    ds_dict["number_of_nodes"] = G.number_of_nodes()
+    ds_dict["number_of_edges"] = G.number_of_edges()
+    ds_dict["number_of_communities"] = len(np.unique(community_labels))
+
+    if ds_dict["number_of_communities"] < min_communities:
+        raise ValueError(f"{ds_dict['number_of_communities']} communities, at least {min_communities} are needed")
+
+    # ECS
+    user_emb = EchoGAE_algorithm(G, user_embeddings=users_embeddings, show_progress=False, hidden_channels=20, 
+                                    out_channels=10, epochs=300)
+    ecm = EchoChamberMeasure(user_emb, community_labels)
+    eci = ecm.echo_chamber_index()
+    ds_dict["echo_chamber_score"] = eci
+
+    # For communities ECIs and Sizes
+    sizes = []
+    ECSs = []
+
+    for i in np.unique(community_labels):
+        sizes.append(np.sum(community_labels == i))
+        ECSs.append(ecm.community_echo_chamber_index(i))
+
+    ds_dict["community_sizes"] = sizes
+    ds_dict["community_ECIs"] = ECSs
+
+    return ds_dict, users_information, community_labels, author_id_to_index_map
+
+
+def prepare_dataset(path):
+    '''Writes the files get_data reads from the weighted retweet graph (s3) and the user embedding matrix (s4) if they are missing, and returns the graph.
+
+    NOTE: get_data takes a path and reads and parses these files itself, so the user embedding matrix is only loaded to write
+    embeddings.feather, and the graph is only used for its size in the ECS information.
+    '''
+    graph = WeightedGraph.load(path)
 
-print(f"Dataset ({ds}): ", end="")
+    # NOTE: get_data reads the edges.csv and nodes.csv pair itself, so it is written from the graph if s3 skipped it (WRITE_CSV)
+    if not (os.path.exists(f"{path}edges.csv") and os.path.exists(f"{path}nodes.csv")):
+        graph.to_csv(path)
 
-ds_dict = {}
-ds_dict["dataset"] = ds
+    # NOTE: get_data reads embeddings.feather itself, so it is written from the matrix if s4 skipped it (WRITE_EMBEDDINGS_FEATHER)
+    if not os.path.exists(f"{path}embeddings.feather"):
+        UserEmbeddings.load(path).to_frame().to_feather(f"{path}embeddings.feather")
 
-# Get the data
-# NOTE: See https://github.com/pyg-team/pytorch_geometric/issues/92
-G, users_embeddings, community_labels, author_id_to_index_map, users_information = get_data(path=f"{ds}", 
-                                                                                          resolution=RES_VALUE, 
-                                                                                          min_comm_size=COMM_SIZE,
-                                                                                          directed_graph=True, # TO DO: decide whether directed or undirected
-                                                                                          min_degree=MIN_DEGREE,
-                                                                                          min_tweets=MIN_TWEETS)
+    return graph
+
+
+def save_results(path, resolution, ds_dict, users_information, community_labels, author_id_to_index_map):
+    '''Writes the ECS information, users_information and the community maps of a dataset into its directory.'''
+    # Create df for "ecs_information"
+    ecs_information = []
+    ecs_information.append(ds_dict)
+    ecs_information_df = pd.DataFrame(ecs_information)
+
+    # Delete from df "tweets" and "embeddings"
+    users_information = users_information[["author_id", "community"]]
+
+    # Save results
+    ecs_information_df.to_csv(f"{path}/ecs_information_resolution_{resolution}.csv", index=False) 
+    users_information.to_csv(f"{path}/users_information.csv", index=False) 
+
+
+    # Create mappings from community to users and user to community 
+    community_to_author_ids_map = {}
+    author_id_to_community_map = {}
 
+    # Extract all "author_ids" from the "author_id_index_map"
+    author_ids = author_id_to_index_map.keys()
 
-# Graph information
-ds_dict["number_of_nodes"] = G.number_of_nodes()
-ds_dict["number_of_edges"] = G.number_of_edges()
-ds_dict["number_of_communities"] = len(np.unique(community_labels))
+    # Iterate through pairs of "author_ids" and corresponding "community_labels"
+    # NOTE: As strings, the author IDs are JSON-serializable whether get_data returns them as str or as numpy integers
+    for author_id, community_label in zip(author_ids, community_labels):
+        community_to_author_ids_map.setdefault(f"Community_{community_label}", []).append(str(author_id))
+        author_id_to_community_map[str(author_id)] = f"Community_{community_label}"
 
-# ECS
-user_emb = EchoGAE_algorithm(G, user_embeddings=users_embeddings, show_progress=False, hidden_channels=20, 
-                                out_channels=10, epochs=300)
-ecm = EchoChamberMeasure(user_emb, community_labels)
-eci = ecm.echo_chamber_index()
-ds_dict["echo_chamber_score"] = eci
+    # Save "community_to_author_ids_map"
+    with open(f"{path}/" + "community_to_author_ids_map.json", "w") as json_file:
+        json.dump(community_to_author_ids_map, json_file)
 
-print(f"ECS = {eci:.3f} -- ", end=" ")
+    # Save "author_id_to_community_map" 
+    with open(f"{path}/" + "author_id_to_community_map.json", "w") as json_file:
+        json.dump(author_id_to_community_map, json_file)  
 
-# For communities ECIs and Sizes
-sizes = []
-ECSs = []
 
-for i in np.unique(community_labels):
-    sizes.append(np.sum(community_labels == i))
-    ECSs.append(ecm.community_echo_chamber_index(i))
+def run_ecs(path, resolution=RES_VALUE, min_comm_size=COMM_SIZE, min_degree=MIN_DEGREE, min_tweets=MIN_TWEETS):
+    '''Computes the ECS of the dataset in path from the seeds of this script, saves its results and returns its ECS information.'''
+    set_seeds(seed_value)
+    graph = prepare_dataset(path)
+    ds_dict, users_information, community_labels, author_id_to_index_map = compute_ecs(path, resolution, min_comm_size, min_degree, min_tweets, graph=graph)
+    save_results(path, resolution, ds_dict, users_information, community_labels, author_id_to_index_map)
+    return ds_dict
 
-ds_dict["community_sizes"] = sizes
-ds_dict["community_ECIs"] = ECSs
 
-print("")
+def init_worker(n_threads):
+    torch.set_num_threads(n_threads)
 
 
-# Create df for "ecs_information"
-ecs_information.append(ds_dict)
-ecs_information_df = pd.DataFrame(ecs_information)
+# NOTE: Set right before the sweep's pool is forked, so that the workers report its size without loading or pickling it (get_data still reads its files per combination)
+sweep_graph = None
 
-# Delete from df "tweets" and "embeddings"
-users_information = users_information[["author_id", "community"]]
 
-# Save results
-ecs_information_df.to_csv(f"{ds}/ecs_information_resolution_{RES_VALUE}.csv", index=False) 
-users_information.to_csv(f"{ds}/users_information.csv", index=False) 
+def evaluate_filters(config):
+    '''Computes the ECS for one combination of the sweep. Combinations that fail or give fewer than two communities are marked as skipped.'''
+    path, res_value, comm_size, min_degree, min_tweets = config
+    result = {"res_value": res_value, "comm_size": comm_size, "min_degree": min_degree, "min_tweets": min_tweets}
 
+    start = time.perf_counter()
+    set_seeds(seed_value)  # NOTE: Every combination starts from the same seeds, as a run of this script does
+    try:
+        ds_dict = compute_ecs(path, res_value, comm_size, min_degree, min_tweets, graph=sweep_graph, min_communities=2)[0]
+        result.update({"status": "ok", **{key: value for key, value in ds_dict.items() if key != "dataset"}})
+    except Exception as e:
+        result["status"] = f"skipped: {type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
 
-# Create mappings from community to users and user to community 
-community_to_author_ids_map = {}
-author_id_to_community_map = {}
 
-# Extract all "author_ids" from the "author_id_index_map"
-author_ids = author_id_to_index_map.keys()
+def sweep_ecs(path, grid, n_workers=SWEEP_WORKERS):
+    '''Computes the ECS for every combination of the filters in grid and returns one table with a row per combination.
+
+    NOTE: Only the files get_data reads are written (if missing) and the graph is loaded once, in this process. get_data takes a
+    path rather than data, so every combination still reads and parses edges.csv, nodes.csv, tweets.feather and embeddings.feather
+    itself (from the page cache after the first one), and builds its own graph and user embeddings from them.
+    '''
+    global sweep_graph
+    sweep_graph = prepare_dataset(path)
+    configs = [(path, *values) for values in itertools.product(grid['res_value'], grid['comm_size'], grid['min_degree'], grid['min_tweets'])]
+
+    if n_workers <= 1:
+        results = [evaluate_filters(config) for config in configs]
+    else:
+        # NOTE: 'fork', as spawned workers would re-run this script; forked before the run below, so before CUDA is initialised here
+        n_threads = max(1, os.cpu_count() // n_workers)
+        with multiprocessing.get_context('fork').Pool(n_workers, initializer=init_worker, initargs=(n_threads,)) as pool:
+            results = pool.map(evaluate_filters, configs, chunksize=1)
+
+    return pd.DataFrame(results)
+
+
+def evaluate_dataset(path):
+    '''Computes and saves the ECS of one dataset of the batch. A dataset that fails is marked as skipped.'''
+    result = {"dataset": path}
+    start = time.perf_counter()
+    try:
+        result.update({"status": "ok", **run_ecs(path)})
+    except Exception as e:
+        result["status"] = f"skipped: {type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def batch_ecs(paths, n_workers=BATCH_WORKERS):
+    '''Computes and saves the ECS of every dataset in paths and returns a summary with a row per dataset.'''
+    if n_workers <= 1:
+        results = [evaluate_dataset(path) for path in paths]
+    else:
+        # NOTE: Forked workers start with the libraries (torch, torch_geometric, src) imported here, and each computes several datasets
+        n_threads = max(1, os.cpu_count() // n_workers)
+        with multiprocessing.get_context('fork').Pool(min(n_workers, len(paths)), initializer=init_worker, initargs=(n_threads,)) as pool:
+            results = pool.map(evaluate_dataset, paths, chunksize=1)
+
+    return pd.DataFrame(results)
+
+
+# %%
+# Compute the ECS for every combination of the filters in SWEEP_GRID
+if SWEEP:
+    sweep_results = sweep_ecs(ds, SWEEP_GRID)
+    sweep_results.insert(0, "dataset", ds)
+    sweep_results.to_csv(f"{ds}/ecs_sweep.csv", index=False)
+
+    print(sweep_results[sweep_results["status"] == "ok"].sort_values("echo_chamber_score", ascending=False))
+    print(f"{(sweep_results['status'] != 'ok').sum()} of {len(sweep_results)} combinations skipped, {sweep_results['seconds'].sum():,.0f} s of compute in total")
+
+
+# %%
+# Compute the ECS of every dataset in BATCH_DATASETS
+if BATCH:
+    batch_summary = batch_ecs(BATCH_DATASETS)
+    batch_summary.to_csv(BATCH_SUMMARY_PATH, index=False)
+
+    print(batch_summary.reindex(columns=["dataset", "status", "number_of_communities", "echo_chamber_score", "seconds"]).to_string(index=False))
+
+
+# %%
+# ECS metric
+if not BATCH:
+    print(f"Dataset ({ds}): ", end="")
 
-# Iterate through pairs of "author_ids" and corresponding "community_labels"
-for author_id, community_label in zip(author_ids, community_labels):
-    community_to_author_ids_map.setdefault(f"Community_{community_label}", []).append(author_id)
-    author_id_to_community_map[str(author_id)] = f"Community_{community_label}"
+    ds_dict = run_ecs(ds)
 
-# Save "community_to_author_ids_map"
-with open(f"{ds}/" + "community_to_author_ids_map.json", "w") as json_file:
-    json.dump(community_to_author_ids_map, json_file)
+    print(f"ECS = {ds_dict['echo_chamber_score']:.3f} -- ", end=" ")
 
-# Save "author_id_to_community_map" 
-with open(f"{ds}/" + "author_id_to_community_map.json", "w") as json_file:
-    json.dump(author_id_to_community_map, json_file)  
+    print("")
 
-print("\n\n")
+    print("\n\n")
 
 
 # %%
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from weighted_graph import WeightedGraph
+
+
+class TemporalNetwork:
+    '''Weighted directed network over a window that slides along a stream of edges, updated incrementally.
+
+    Every edge occurrence has a time span [first, last] (for a retweet: the creation of the original tweet and of the
+    retweet, in int64 nanoseconds) and is in a window if the span lies within it, as in the windows of s3. Moving the
+    window forward retires the occurrences whose first time the start has passed and adds those whose last time the
+    end has reached. Edge weights, degrees and the node and edge counts are updated with them, so each move only
+    costs the occurrences that enter or leave the window.
+    '''
+
+    def __init__(self, sources, targets, first, last):
+        sources, targets = np.asarray(sources), np.asarray(targets)
+        codes, self.labels = pd.factorize(np.concatenate([sources, targets]))
+        n_nodes = len(self.labels)
+
+        # Distinct (source, target) pairs, with the pair of each occurrence
+        pair_keys = codes[:len(sources)].astype(np.int64) * n_nodes + codes[len(sources):]
+        self.pair_codes, pairs = pd.factorize(pair_keys)
+        self.pair_sources = (pairs // n_nodes).astype(np.int32)
+        self.pair_targets = (pairs % n_nodes).astype(np.int32)
+
+        # Occurrences in the order they enter (by last time) and leave (by first time) a forward-moving window
+        self.first, self.last = np.asarray(first), np.asarray(last)
+        self.entry_order = np.argsort(self.last, kind='stable')
+        self.exit_order = np.argsort(self.first, kind='stable')
+        self.entry_times = self.last[self.entry_order]
+        self.exit_times = self.first[self.exit_order]
+        self.entry_position = 0
+        self.exit_position = 0
+
+        # State of the current window
+        self.active = np.zeros(len(sources), dtype=bool)
+        self.weights = np.zeros(len(pairs), dtype=np.int64)
+        self.out_degree = np.zeros(n_nodes, dtype=np.int64)
+        self.in_degree = np.zeros(n_nodes, dtype=np.int64)
+        self.number_of_nodes = 0
+        self.number_of_edges = 0
+        self.total_weight = 0
+        self.start = None
+        self.end = None
+
+    def _update(self, occurrences, sign):
+        '''Adds (sign=1) or removes (sign=-1) occurrences and updates the degrees and counts of the pairs and nodes whose presence changed.'''
+        if len(occurrences) == 0:
+            return
+        pairs, counts = np.unique(self.pair_codes[occurrences], return_counts=True)
+
+        present_before = self.weights[pairs] > 0
+        self.weights[pairs] += sign * counts
+        changed = present_before != (self.weights[pairs] > 0)
+        changed_pairs = pairs[changed]
+        delta = np.where(present_before[changed], -1, 1)
+
+        nodes = np.unique(np.concatenate([self.pair_sources[changed_pairs], self.pair_targets[changed_pairs]]))
+        nodes_before = (self.out_degree[nodes] + self.in_degree[nodes]) > 0
+        np.add.at(self.out_degree, self.pair_sources[changed_pairs], delta)
+        np.add.at(self.in_degree, self.pair_targets[changed_pairs], delta)
+        nodes_after = (self.out_degree[nodes] + self.in_degree[nodes]) > 0
+
+        self.number_of_nodes += int(nodes_after.sum() - nodes_before.sum())
+        self.number_of_edges += int(delta.sum())
+        self.total_weight += sign * len(occurrences)
+
+    def move(self, start, end):
+        '''Moves the window to [start, end] (int64 nanoseconds, both included). Windows must not move backwards.'''
+        if self.start is not None and (start < self.start or end < self.end):
+            raise ValueError('TemporalNetwork windows can only move forward')
+
+        # Retire the occurrences that started before the window
+        stop = np.searchsorted(self.exit_times, start, side='left')
+        leaving = self.exit_order[self.exit_position:stop]
+        leaving = leaving[self.active[leaving]]
+        self.exit_position = stop
+        self.active[leaving] = False
+        self._update(leaving, -1)
+
+        # Add the occurrences that ended by the end of the window and did not start before it
+        stop = np.searchsorted(self.entry_times, end, side='right')
+        entering = self.entry_order[self.entry_position:stop]
+        entering = entering[self.first[entering] >= start]
+        self.entry_position = stop
+        self.active[entering] = True
+        self._update(entering, 1)
+
+        self.start, self.end = start, end
+
+    def run(self, starts, ends):
+        '''Moves the window through each of the (start, end) bounds in turn and yields the network after each move.'''
+        for start, end in zip(starts, ends):
+            self.move(start, end)
+            yield self
+
+    def statistics(self):
+        degree = self.out_degree + self.in_degree
+        return {'number_of_nodes': self.number_of_nodes, 'number_of_edges': self.number_of_edges, 'total_weight': self.total_weight,
+                'mean_degree': degree.sum() / max(self.number_of_nodes, 1), 'max_degree': int(degree.max(initial=0))}
+
+    def degree_distribution(self, kind='total'):
+        '''Number of nodes in the window per degree ('in', 'out' or 'total' number of distinct neighbours).'''
+        degree = {'in': self.in_degree, 'out': self.out_degree, 'total': self.in_degree + self.out_degree}[kind]
+        return np.bincount(degree[(self.in_degree + self.out_degree) > 0])
+
+    def snapshot(self):
+        '''The network in the window as a WeightedGraph, built from the current edge weights.'''
+        nodes = np.flatnonzero((self.out_degree + self.in_degree) > 0)
+        index = np.full(len(self.labels), -1, dtype=np.int32)
+        index[nodes] = np.arange(len(nodes), dtype=np.int32)
+
+        pairs = np.flatnonzero(self.weights > 0)
+        adjacency = sp.csr_matrix((self.weights[pairs], (index[self.pair_sources[pairs]], index[self.pair_targets[pairs]])), shape=(len(nodes), len(nodes)))
+        return WeightedGraph(adjacency, np.asarray(self.labels)[nodes])
+
+    def communities(self, resolution=1.0, seed=42):
+        '''Louvain communities of the network in the window, as a label per node of snapshot().'''
+        import networkx as nx
+
+        snapshot = self.snapshot()
+        G = nx.from_scipy_sparse_array(snapshot.adjacency, create_using=nx.DiGraph)
+        labels = np.empty(snapshot.number_of_nodes(), dtype=np.int32)
+        for label, members in enumerate(nx.community.louvain_communities(G, weight='weight', resolution=resolution, seed=seed)):
+            labels[list(members)] = label
+        return labels
@@ -0,0 +1,205 @@
+# Assigns topics to new (cleaned) tweets with the topic model saved by s2, without fitting anything.
+#
+# Usage:
+#   python topic_classifier.py batch tweets.feather topics.feather [--embeddings embeddings.npy]
+#   python topic_classifier.py stream < tweets.jsonl > topics.jsonl
+#   python topic_classifier.py serve [--port 8000]
+#   python topic_classifier.py benchmark tweets.feather
+#
+# Input tweets have a 'text_clean' column (feather/parquet) or field (JSON lines), and optionally an 'id'.
+# Stream lines without a 'text_clean' string are answered with {"id": ..., "error": ...} instead of a topic.
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bertopic import BERTopic
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+BERTOPIC_RESULTS_PATH = '/root/data/bigsss/analysis_drews/bigsss_russo_ukraine/with_topics/bertopic_results/'
+
+MODEL_PATH = BERTOPIC_RESULTS_PATH + 'bertopic_model_merged'  # NOTE: Saved by s2 after merging the Russo-Ukraine topics, so the merged topic mapping is applied
+RUSSO_UKRAINE_TOPIC = 0  # NOTE: Topic of the merged Russo-Ukraine topics, as in s2
+
+BATCH_SIZE = 4096
+BENCHMARK_BATCH_SIZES = [1, 16, 256, 4096]
+
+
+class TopicClassifier:
+    '''Loads the saved topic model once and assigns topics to batches of cleaned tweets or precomputed embeddings.'''
+
+    def __init__(self, path=MODEL_PATH):
+        self.model = BERTopic.load(path)
+
+    def classify(self, docs=None, embeddings=None):
+        '''Returns a DataFrame with the 'topic' and the 'russo_ukraine' flag of each tweet.'''
+        if embeddings is None:
+            embeddings = self.model.embedding_model.embed_documents(docs)
+        if docs is None:
+            docs = [''] * len(embeddings)  # NOTE: With precomputed embeddings the texts are not needed
+
+        # Same steps as in s2: predict the topics, then reduce outliers using the `embeddings` strategy
+        topics, _ = self.model.transform(docs, embeddings)
+        topics = np.asarray(self.model.reduce_outliers(docs, topics, strategy='embeddings', embeddings=embeddings))
+
+        return pd.DataFrame({'topic': topics, 'russo_ukraine': (topics == RUSSO_UKRAINE_TOPIC).astype(int)})
+
+
+def read_tweets(path):
+    return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_feather(path)
+
+
+def classify_batches(classifier, docs=None, embeddings=None, batch_size=BATCH_SIZE):
+    '''Classifies docs and/or embeddings in batches of batch_size and returns one DataFrame.'''
+    n = len(docs) if docs is not None else len(embeddings)
+    if n == 0:
+        return pd.DataFrame({'topic': np.array([], dtype=int), 'russo_ukraine': np.array([], dtype=int)})
+
+    results = []
+    for start in range(0, n, batch_size):
+        batch = slice(start, start + batch_size)
+        results.append(classifier.classify(docs[batch] if docs is not None else None, embeddings[batch] if embeddings is not None else None))
+    return pd.concat(results, ignore_index=True)
+
+
+def check_batch_input(df, embeddings):
+    '''Returns what is wrong with the input of the batch command, or None if it can be classified.'''
+    if 'text_clean' not in df and embeddings is None:
+        return "the input has no 'text_clean' column, pass precomputed embeddings with --embeddings"
+    if embeddings is not None and (embeddings.ndim != 2 or len(embeddings) != len(df)):
+        return f'--embeddings must be a matrix with one row per tweet ({len(df):,}), got shape {embeddings.shape}'
+    return None
+
+
+def run_batch(classifier, args):
+    df, embeddings = args.tweets, args.embedding_matrix  # NOTE: Read and checked before the model is loaded
+    docs = df['text_clean'].tolist() if 'text_clean' in df else None
+
+    result = classify_batches(classifier, docs, embeddings, args.batch_size)
+    if 'id' in df:
+        result.insert(0, 'id', df['id'].to_numpy())
+    result.to_feather(args.output)
+
+
+def parse_stream_line(line):
+    '''Returns the tweet on a line of the stream and None, or None and an error record if it is not a JSON object with a 'text_clean' string.'''
+    try:
+        tweet = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, {'id': None, 'error': f'invalid JSON: {e}'}
+    if not isinstance(tweet, dict):
+        return None, {'id': None, 'error': 'not a JSON object'}
+    if not isinstance(tweet.get('text_clean'), str):
+        return None, {'id': tweet.get('id'), 'error': "no 'text_clean' string"}
+    return tweet, None
+
+
+def run_stream(classifier, args):
+    '''Reads tweets as JSON lines from stdin and writes their topics as JSON lines to stdout, batch_size tweets at a time.
+
+    Lines that cannot be classified are answered with an error record in their place, and the stream goes on.
+    '''
+    def flush(lines):
+        tweets = [tweet for tweet, _ in lines if tweet is not None]
+        result = classifier.classify([tweet['text_clean'] for tweet in tweets]) if tweets else None
+        topics = zip(result['topic'], result['russo_ukraine']) if tweets else iter(())
+        for tweet, error in lines:
+            if tweet is None:
+                record = error
+            else:
+                topic, russo_ukraine = next(topics)
+                record = {'id': tweet.get('id'), 'topic': int(topic), 'russo_ukraine': int(russo_ukraine)}
+            sys.stdout.write(json.dumps(record) + '\n')
+        sys.stdout.flush()
+
+    lines = []
+    for line in sys.stdin:
+        if line.strip():
+            lines.append(parse_stream_line(line))
+        if len(lines) == args.batch_size:
+            flush(lines)
+            lines = []
+    if lines:
+        flush(lines)
+
+
+def run_server(classifier, args):
+    '''Serves POST /classify with {"texts": [...]} or {"embeddings": [[...], ...]} and answers {"topic": [...], "russo_ukraine": [...]}.'''
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/classify':
+                self.send_error(404)
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                embeddings = np.asarray(request['embeddings'], dtype=np.float32) if 'embeddings' in request else None
+                result = classify_batches(classifier, request.get('texts'), embeddings, args.batch_size)
+            except (KeyError, TypeError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+
+            body = json.dumps({'topic': result['topic'].tolist(), 'russo_ukraine': result['russo_ukraine'].tolist()}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    # NOTE: Single-threaded, as the model is not meant to be used from several threads at once
+    print(f'Serving topic classification on http://{args.host}:{args.port}/classify')
+    HTTPServer((args.host, args.port), Handler).serve_forever()
+
+
+def run_benchmark(classifier, args):
+    '''Reports latency per batch and throughput for each of BENCHMARK_BATCH_SIZES.'''
+    df = read_tweets(args.input)
+    docs = df['text_clean'].head(args.n).tolist()
+    embeddings = classifier.model.embedding_model.embed_documents(docs)
+
+    for batch_size in BENCHMARK_BATCH_SIZES:
+        latencies = []
+        for start in range(0, len(docs), batch_size):
+            started = time.perf_counter()
+            classifier.classify(docs[start:start + batch_size], embeddings[start:start + batch_size])
+            latencies.append(time.perf_counter() - started)
+        print(f'Batch size {batch_size:>5}: {np.mean(latencies) * 1000:,.1f} ms per batch (p95 {np.percentile(latencies, 95) * 1000:,.1f} ms), '
+              f'{len(docs) / sum(latencies):,.0f} tweets/sec (embeddings precomputed)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Assign topics to cleaned tweets with the saved BERTopic model.')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('batch', help='classify a feather/parquet file of tweets')
+    batch.add_argument('input')
+    batch.add_argument('output')
+    batch.add_argument('--embeddings', help='.npy matrix of precomputed embeddings, one row per tweet')
+
+    commands.add_parser('stream', help='classify JSON lines from stdin')
+
+    serve = commands.add_parser('serve', help='classify tweets over a local HTTP endpoint')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+
+    benchmark = commands.add_parser('benchmark', help='report latency and throughput per batch size')
+    benchmark.add_argument('input')
+    benchmark.add_argument('-n', type=int, default=20_000, help='number of tweets to benchmark on')
+
+    args = parser.parse_args()
+
+    if args.command == 'batch':
+        args.tweets = read_tweets(args.input)
+        args.embedding_matrix = np.load(args.embeddings, mmap_mode='r') if args.embeddings else None
+        error = check_batch_input(args.tweets, args.embedding_matrix)
+        if error is not None:
+            batch.error(error)
+
+    classifier = TopicClassifier(args.model)
+
+    {'batch': run_batch, 'stream': run_stream, 'serve': run_server, 'benchmark': run_benchmark}[args.command](classifier, args)
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn.preprocessing import normalize
+
+
+class TopicTimeCube:
+    '''Topic × day × slice × term counts of the tweets, built once from the document-term matrix of s2.
+
+    Topic frequencies and representations over time are computed by summing the cube's cells into the requested
+    time buckets ('D', 'W' or 'M', as pandas periods) and optional slices (e.g. 'eu_party_group' or 'country'),
+    instead of vectorizing the documents of every timestamp again as BERTopic's topics_over_time does. The
+    representations follow topics_over_time with global_tuning: the c-TF-IDF of a topic in a bucket is averaged
+    with the topic's overall c-TF-IDF, and its top words are refined by the model's representation_model.
+    '''
+
+    def __init__(self, topic_model, dtm_vectorizer, doc_codes, topics, timestamps, slices=None):
+        '''doc_codes are the rows in the document-term matrix of each tweet, topics and timestamps their topics and
+        creation times, and slices a DataFrame of the columns to slice by (one row per tweet).'''
+        self.topic_model = topic_model
+        self.dtm_vectorizer = dtm_vectorizer
+
+        keys = pd.DataFrame({'Topic': np.asarray(topics), 'Day': pd.to_datetime(pd.Series(timestamps)).dt.floor('D').to_numpy()})
+        if slices is not None:
+            for column in slices.columns:
+                keys[column] = slices[column].astype(str).to_numpy()  # NOTE: Strings, so that categorical columns group like the others
+        self.slice_columns = list(slices.columns) if slices is not None else []
+
+        # One cell per distinct (topic, day, slices), holding the term counts of its tweets (repeated tweets count repeatedly)
+        grouped = keys.groupby(list(keys.columns), sort=True)
+        cells = grouped.ngroup().to_numpy()
+        self.cells = grouped.size().reset_index(name='Frequency')
+
+        selection = sp.csr_matrix((np.ones(len(cells)), (cells, np.asarray(doc_codes))), shape=(len(self.cells), dtm_vectorizer.dtm.shape[0]))
+        self.counts = (selection @ dtm_vectorizer.dtm).tocsr()
+
+    def _aggregate(self, freq, by):
+        '''Sums the cells into (topic, bucket, *by) groups and returns the groups with their term counts.'''
+        by = [by] if isinstance(by, str) else list(by or [])
+        cells = self.cells.assign(Timestamp=self.cells['Day'].dt.to_period(freq).dt.to_timestamp())
+
+        grouped = cells.groupby(['Topic', 'Timestamp'] + by, sort=True)
+        groups = grouped.ngroup().to_numpy()
+        result = grouped['Frequency'].sum().reset_index()
+
+        selection = sp.csr_matrix((np.ones(len(groups)), (groups, np.arange(len(groups)))), shape=(len(result), len(groups)))
+        return result, (selection @ self.counts).tocsr()
+
+    def frequencies(self, freq='W', by=None):
+        '''Number of tweets per topic and time bucket (and slice, with by).'''
+        return self._aggregate(freq, by)[0]
+
+    def _represent(self, topic, words, c_tf_idf):
+        '''Refines the candidate (word, c-TF-IDF) pairs of a topic in one bucket with the model's representation_model, as BERTopic does.
+
+        NOTE: No documents are handed to the representation models, so only those that work on the words (e.g.
+        MaximalMarginalRelevance) are supported; None, a list (applied in turn) or a dict (its 'Main' entry) as in BERTopic.
+        '''
+        representation_model = self.topic_model.representation_model
+        if isinstance(representation_model, dict):
+            representation_model = representation_model.get('Main')
+        if representation_model is None:
+            return words
+
+        for model in representation_model if isinstance(representation_model, list) else [representation_model]:
+            words = model.extract_topics(self.topic_model, None, c_tf_idf, {topic: words})[topic]
+        return words
+
+    def topics_over_time(self, freq='W', by=None, top_n_words=5):
+        '''Topics over time in the format of BERTopic's topics_over_time (plus the by columns), for visualize_topics_over_time.'''
+        result, counts = self._aggregate(freq, by)
+        words = self.dtm_vectorizer.get_feature_names_out()
+
+        # c-TF-IDF of each group with the model's fitted IDF, averaged with the normalised c-TF-IDF of its topic
+        c_tf_idf = normalize(self.topic_model.ctfidf_model.transform(counts[:, self.dtm_vectorizer.columns_]), axis=1, norm='l1')
+        global_c_tf_idf = normalize(self.topic_model.c_tf_idf_, axis=1, norm='l1')
+        c_tf_idf = ((c_tf_idf + global_c_tf_idf[result['Topic'].to_numpy() + self.topic_model._outliers]) / 2.0).tocsr()
+
+        # NOTE: As in BERTopic, the representation model chooses among at least 30 candidate words
+        n_candidates = max(self.topic_model.top_n_words, 30)
+        top_words = []
+        for row, (topic, start, end) in enumerate(zip(result['Topic'], c_tf_idf.indptr[:-1], c_tf_idf.indptr[1:])):
+            top = np.argsort(-c_tf_idf.data[start:end], kind='stable')[:n_candidates]
+            candidates = [(words[column], score) for column, score in zip(c_tf_idf.indices[start:end][top], c_tf_idf.data[start:end][top])]
+            top_words.append(', '.join(word for word, _ in self._represent(topic, candidates, c_tf_idf[row])[:top_n_words]))
+        result.insert(1, 'Words', top_words)
+
+        return result[['Topic', 'Words', 'Frequency', 'Timestamp'] + [column for column in result.columns if column in self.slice_columns]]
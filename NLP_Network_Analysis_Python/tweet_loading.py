@@ -0,0 +1,140 @@
+import glob
+
+import ijson
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+
+
+# Raw tweets
+RAW_COLUMNS = ['id', 'author_id', 'created_at', 'text', 'referenced_tweets']
+
+# Translated tweets
+TRANSLATED_COLUMNS = ['id', 'text_translated', 'name', 'username', 'day', 'month', 'year', 'dob', 'full_name', 'sex', 'country', 'nat_party', 'nat_party_abb', 'eu_party_group', 'eu_party_abbr', 'commission_dummy', 'party_id', 'eu_position', 'lrgen', 'lrecon', 'galtan', 'eu_eu_position', 'eu_lrgen', 'eu_lrecon', 'eu_galtan']
+CATEGORICAL_COLUMNS = ['sex', 'country', 'nat_party', 'nat_party_abb', 'eu_party_group', 'eu_party_abbr']  # NOTE: Low-cardinality strings, stored as categoricals
+
+# Referenced tweets
+REFERENCE_TYPES = ['quoted', 'replied_to', 'retweeted']  # NOTE: Fixed categories, so that 'action' stays categorical when chunks are concatenated
+REFERENCED_TWEETS_TYPE = pa.list_(pa.struct([('type', pa.string()), ('id', pa.string())]))
+
+# Partitioned output
+# NOTE: Every partition is written with the same schema (see final_schema), so that later scripts can read them as one table
+FINAL_COLUMNS = ['id', 'user_id', 'created_at', 'text', 'text_translated', 'action', 'action_id', 'name', 'username', 'day', 'month', 'year', 'dob', 'full_name', 'sex', 'country', 'nat_party', 'nat_party_abb', 'eu_party_group', 'eu_party_abbr', 'commission_dummy', 'party_id', 'eu_position', 'lrgen', 'lrecon', 'galtan', 'eu_eu_position', 'eu_lrgen', 'eu_lrecon', 'eu_galtan', 'text_clean', 'mentioned_user_ids']
+FINAL_TYPES = {
+    'id': pa.int64(),
+    'user_id': pa.int64(),
+    'created_at': pa.string(),
+    'text': pa.string(),
+    'text_translated': pa.string(),
+    'action': pa.dictionary(pa.int32(), pa.string()),
+    'action_id': pa.int64(),
+    'text_clean': pa.string(),
+    'mentioned_user_ids': pa.list_(pa.int64()),
+    **{column: pa.dictionary(pa.int32(), pa.string()) for column in CATEGORICAL_COLUMNS},
+}  # NOTE: The other columns keep their type in the translated tweets' file
+
+
+def tweets_frame(rows):
+    '''Builds a DataFrame with the RAW_COLUMNS from parsed tweets, with the IDs as int64.
+
+    NOTE: The IDs were strings before; the files that get_data reads in s5 (tweets.feather, embeddings.feather) write them as strings again.
+    '''
+    df = pd.DataFrame(rows, columns=RAW_COLUMNS)
+    df['id'] = df['id'].astype('int64')
+    df['author_id'] = df['author_id'].astype('int64')
+    return df
+
+
+def read_tweets(path, chunk_size=100_000):
+    '''Parses the tweet array in a JSON file incrementally and yields DataFrames of up to chunk_size tweets with only the RAW_COLUMNS.'''
+    rows = []
+    with open(path, 'rb') as file:
+        for tweet in ijson.items(file, 'item', use_float=True):
+            rows.append({column: tweet.get(column) for column in RAW_COLUMNS})
+            if len(rows) == chunk_size:
+                yield tweets_frame(rows)
+                rows = []
+    if rows:
+        yield tweets_frame(rows)
+
+
+def load_translated_tweets(path):
+    '''Reads only the TRANSLATED_COLUMNS, with the IDs as int64 and the CATEGORICAL_COLUMNS as categoricals.'''
+    df = pd.read_feather(path, columns=TRANSLATED_COLUMNS)
+    df['id'] = df['id'].astype('int64')
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].replace(r'^\s*$', np.nan, regex=True).astype('category')  # NOTE: Empty cells become NaN, not a category
+    return df
+
+
+def parse_referenced_tweets(df):
+    '''Decodes 'referenced_tweets' into a categorical 'action' and an integer 'action_id' column.
+
+    NOTE: Tweets that reference several tweets keep the first reference, which is also the 'action' the comma-joined string gave them.
+    '''
+    references = pa.array(df.pop('referenced_tweets').tolist(), type=REFERENCED_TWEETS_TYPE, from_pandas=True)
+
+    # Position of each tweet's first reference in the flattened list of all references
+    has_reference = pc.list_value_length(references).fill_null(0).to_numpy() > 0
+    first_references = references.values.take(pa.array(references.offsets.to_numpy()[:-1][has_reference]))
+
+    action = np.full(len(df), None, dtype=object)
+    action[has_reference] = first_references.field('type').to_numpy(zero_copy_only=False)
+    df['action'] = pd.Categorical(action, categories=REFERENCE_TYPES)
+
+    action_id = np.zeros(len(df), dtype='int64')
+    action_id[has_reference] = pc.cast(first_references.field('id'), pa.int64()).to_numpy()
+    df['action_id'] = pd.arrays.IntegerArray(action_id, ~has_reference)
+    return df
+
+
+def final_partitions(path):
+    '''Returns the feather files of the partitioned output in path in the order they were written.'''
+    return sorted(glob.glob(path + 'part-*.feather'))
+
+
+def read_partitions(path, columns):
+    '''Reads the given columns of all partitions in path as one data frame (None if there are none).'''
+    if not final_partitions(path):
+        return None
+    return ds.dataset(final_partitions(path), format='feather').to_table(columns=columns).to_pandas()
+
+
+def final_schema(translated_path):
+    '''The schema of every partition: the FINAL_TYPES, and the type in the translated tweets' file for the other columns.
+
+    NOTE: Inferred per run, a column could get another type in each partition (e.g. null when all its cells are empty).
+    '''
+    translated = ds.dataset(translated_path, format='feather').schema
+    return pa.schema([(column, FINAL_TYPES[column] if column in FINAL_TYPES else translated.field(column).type) for column in FINAL_COLUMNS])
+
+
+def write_partition(df, schema, path):
+    '''Adds df as the next partition of the output in path, with the given schema.'''
+    table = pa.Table.from_pandas(df[schema.names].reset_index(drop=True), schema=schema, preserve_index=False)
+    feather.write_feather(table, path + f'part-{len(final_partitions(path)):05d}.feather')
+
+
+def processed_id_files(path):
+    return sorted(glob.glob(path + 'processed-*.feather'))
+
+
+def processed_ids(path, final_path):
+    '''Returns the IDs of all tweets that earlier runs processed: those they recorded in path, and those in the partitioned output in final_path.
+
+    NOTE: Partitions are included for outputs written before the processed IDs were recorded.
+    '''
+    ids = [pd.read_feather(file)['id'] for file in processed_id_files(path)]
+    if final_partitions(final_path):
+        ids.append(read_partitions(final_path, ['id'])['id'])
+    if not ids:
+        return pd.Index([])
+    return pd.Index(pd.concat(ids, ignore_index=True).unique())
+
+
+def new_tweets(df, existing_ids):
+    '''Keeps the tweets whose IDs are not in existing_ids.'''
+    return df[~df['id'].isin(existing_ids)].reset_index(drop=True)
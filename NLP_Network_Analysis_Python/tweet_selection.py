@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+
+def original_tweets(df):
+    '''The original tweets (not retweets) of df as 'author_id', 'tweets' (the translated text, as str) and 'created_at'.'''
+    # rename user_id to author_id for the rest of the analysis
+    df = df.rename(columns={'user_id': 'author_id'})
+
+    # NOTE: Keep original tweets ONLY (not retweets)
+    df = df[~df['action'].isin(['retweeted'])]
+
+    # Keep certain columns and rename them
+    df = df[['author_id', 'text_translated', 'created_at']].rename(columns={'text_translated': 'tweets'})
+
+    # Convert tweets to str
+    df['tweets'] = df['tweets'].astype(str)
+    return df
+
+
+def tweets_in_periods(df, periods):
+    '''The tweets of df created in any of the periods, sorted by author and time, so that each period's tweets of an author are consecutive.'''
+    in_any_period = np.logical_or.reduce([((df['created_at'] >= start) & (df['created_at'] <= end)).to_numpy() for _, start, end, _ in periods])
+    return df[in_any_period].sort_values(['author_id', 'created_at'], kind='stable').reset_index(drop=True)
+
+
+def select_tweets(df, start, end, max_tweets=200, sampling='first', seed=42):
+    '''Flat table of the tweets of each author in df (sorted by author and time) created in [start, end], at most max_tweets per author.
+
+    The table is sorted by author and time, and 'row' is each tweet's position in df. With sampling='reservoir', the
+    max_tweets tweets with the smallest random keys are kept per author, which draws the same uniform sample as
+    reservoir sampling; the keys belong to the rows of df, so overlapping periods sample consistently for a seed.
+    '''
+    rows = np.flatnonzero(((df['created_at'] >= start) & (df['created_at'] <= end)).to_numpy())
+    authors = df['author_id'].to_numpy()[rows]
+
+    # Author number of each tweet and position of each author's first tweet
+    new_author = np.concatenate([[True], authors[1:] != authors[:-1]])[:len(rows)]
+    group = np.cumsum(new_author) - 1
+    first = np.flatnonzero(new_author)
+
+    if sampling == 'first':
+        rank = np.arange(len(rows)) - first[group]
+    elif sampling == 'reservoir':
+        keys = np.random.default_rng(seed).random(len(df))[rows]
+        by_key = np.lexsort((keys, group))
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[by_key] = np.arange(len(rows)) - first[group[by_key]]
+    else:
+        raise ValueError(f"Unknown sampling '{sampling}', use 'first' or 'reservoir'")
+
+    rows = rows[rank < max_tweets]
+    tweets = df.iloc[rows][['author_id', 'tweets', 'created_at']].reset_index(drop=True)
+    tweets.insert(0, 'row', rows)
+    return tweets
+
+
+def author_offsets(tweets):
+    '''The authors of a flat tweets table (sorted by author), with the offset of each author's first tweet and their number of tweets.'''
+    author_ids, offsets, counts = np.unique(tweets['author_id'].to_numpy(), return_index=True, return_counts=True)
+    return pd.DataFrame({'author_id': author_ids, 'offset': offsets, 'count': counts})
+
+
+def group_tweets(tweets):
+    '''The tweets of a flat tweets table as one array per author, the format of tweets.feather that get_data reads.
+
+    NOTE: The author IDs are int64 from s1 on, but get_data reads them as strings, so they are written as strings.
+    '''
+    authors = author_offsets(tweets)
+    tweets_per_author = np.split(tweets['tweets'].to_numpy(), authors['offset'].to_numpy()[1:]) if len(authors) > 0 else []
+    return pd.DataFrame({'author_id': authors['author_id'].astype(str), 'tweets': tweets_per_author})
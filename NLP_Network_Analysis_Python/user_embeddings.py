@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+class UserEmbeddings:
+    '''User embeddings as one contiguous matrix (a row per user) and the author ID of each row.
+
+    Saved as user_embeddings.npy (float32, or float16 to halve its size) and user_embeddings_author_ids.npy, and
+    memory-mapped when loaded, so readers get the matrix without deserialising an array per user. The author IDs
+    are kept as they are (int64 from s1 on) and only written as strings in the embeddings.feather format.
+
+    NOTE: get_data in s5 takes a path and still reads embeddings.feather, so s5 only loads the matrix to write that file if it is missing.
+    '''
+
+    def __init__(self, author_ids, matrix):
+        self.author_ids = np.asarray(author_ids)
+        self.matrix = matrix
+        self.index = pd.Index(self.author_ids)
+
+    @classmethod
+    def from_frame(cls, df):
+        '''From a data frame in the format of embeddings.feather (an 'author_id' and an 'embeddings' array per user).'''
+        matrix = np.stack(df['embeddings'].to_numpy()) if len(df) > 0 else np.empty((0, 0), dtype=np.float32)
+        return cls(df['author_id'].to_numpy(), matrix)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        return cls(np.load(path + 'user_embeddings_author_ids.npy'), np.load(path + 'user_embeddings.npy', mmap_mode=mmap_mode))
+
+    def save(self, path, dtype='float32'):
+        np.save(path + 'user_embeddings.npy', np.ascontiguousarray(self.matrix, dtype=dtype))
+        np.save(path + 'user_embeddings_author_ids.npy', self.author_ids)
+
+    def __len__(self):
+        return len(self.author_ids)
+
+    def rows(self, author_ids):
+        '''The embeddings of the given authors, as float32.'''
+        positions = self.index.get_indexer(author_ids)
+        if (positions < 0).any():
+            raise KeyError(f'{(positions < 0).sum()} author IDs have no embedding')
+        return np.asarray(self.matrix[positions], dtype=np.float32)
+
+    def to_frame(self):
+        '''The embeddings in the format of embeddings.feather (author IDs as strings, float32 arrays in an object column).'''
+        return pd.DataFrame({'author_id': self.author_ids.astype(str), 'embeddings': list(np.asarray(self.matrix, dtype=np.float32))})
+
+
+def period_embeddings(tweets, tweet_embeddings, valid):
+    '''Mean embedding per author of the selected tweets of a period (see tweet_selection.select_tweets), from the embedding of each tweet.
+
+    The tweets that are left after preprocessing (valid) are averaged, as in the per-period pipeline; authors without any are left out.
+    '''
+    rows = tweets['row'].to_numpy()
+    keep = valid[rows]
+    rows, authors = rows[keep], tweets['author_id'].to_numpy()[keep]
+    author_ids, offsets, counts = np.unique(authors, return_index=True, return_counts=True)  # NOTE: The tweets are sorted by author
+
+    if len(author_ids) == 0:
+        return UserEmbeddings(author_ids, np.empty((0, tweet_embeddings.shape[1]), dtype=tweet_embeddings.dtype))
+    means = np.add.reduceat(tweet_embeddings[rows], offsets, axis=0) / counts[:, None]
+    return UserEmbeddings(author_ids, means.astype(tweet_embeddings.dtype))
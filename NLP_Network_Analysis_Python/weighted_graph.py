@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+class WeightedGraph:
+    '''Directed graph among users with weighted edges, stored as a sparse int32-indexed adjacency matrix and a node table.
+
+    Node i is the user labels[i]; it corresponds to id i + 1 in the nodes.csv files of s3. The weight of the edge
+    source → target is the number of times it occurs among the edges the graph is built from (e.g. retweets).
+    Saved as <name>_graph.npz (CSR matrix) and <name>_nodes.feather (id, label) in the graph's directory.
+    '''
+
+    def __init__(self, adjacency, labels):
+        self.adjacency = adjacency.tocsr()
+        self.labels = np.asarray(labels)
+
+    @classmethod
+    def from_edges(cls, edges, labels=None):
+        '''Builds the graph from a DataFrame of 'source' and 'target' user IDs, one row per occurrence. By default the
+        nodes are numbered in order of appearance, as by create_nodes in s3.'''
+        if labels is None:
+            labels = pd.unique(edges[['source', 'target']].values.ravel('K'))
+        index = pd.Index(labels)
+
+        sources = index.get_indexer(edges['source']).astype(np.int32)
+        targets = index.get_indexer(edges['target']).astype(np.int32)
+        weights = np.ones(len(edges), dtype=np.int32)
+
+        # NOTE: Converting to CSR sums the weights of parallel edges
+        adjacency = sp.coo_matrix((weights, (sources, targets)), shape=(len(index), len(index))).tocsr()
+        adjacency.indices = adjacency.indices.astype(np.int32)
+        adjacency.indptr = adjacency.indptr.astype(np.int32)
+        return cls(adjacency, labels)
+
+    @classmethod
+    def load(cls, path, name='retweet'):
+        adjacency = sp.load_npz(f'{path}{name}_graph.npz')
+        nodes = pd.read_feather(f'{path}{name}_nodes.feather')
+        return cls(adjacency, nodes['label'].to_numpy())
+
+    def save(self, path, name='retweet'):
+        sp.save_npz(f'{path}{name}_graph.npz', self.adjacency, compressed=True)
+        pd.DataFrame({'id': np.arange(1, len(self.labels) + 1, dtype=np.int32), 'label': self.labels}).to_feather(f'{path}{name}_nodes.feather')
+
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    def number_of_edges(self):
+        '''Number of distinct edges; the sum of their weights is the number of edge occurrences.'''
+        return self.adjacency.nnz
+
+    def edges(self):
+        '''The weighted edges as a DataFrame of 'source' and 'target' user IDs and 'weight'.'''
+        coo = self.adjacency.tocoo()
+        return pd.DataFrame({'source': self.labels[coo.row], 'target': self.labels[coo.col], 'weight': coo.data})
+
+    def nodes(self):
+        '''The node table in the format of nodes.csv.'''
+        return pd.DataFrame({'id': np.arange(1, len(self.labels) + 1), 'label': self.labels})
+
+    def to_csv(self, path):
+        '''Writes edges.csv (one row per occurrence, as s3 writes it) and nodes.csv, for readers of the CSV pair.'''
+        edges = self.edges()
+        edges.loc[edges.index.repeat(edges['weight']), ['source', 'target']].to_csv(path + 'edges.csv', index=False)
+        self.nodes().to_csv(path + 'nodes.csv', index=False)
+
+    def to_networkx(self):
+        '''The graph as a networkx DiGraph with user IDs as nodes and a 'weight' attribute on the edges.'''
+        import networkx as nx
+
+        G = nx.from_scipy_sparse_array(self.adjacency, create_using=nx.DiGraph)
+        return nx.relabel_nodes(G, dict(enumerate(self.labels.tolist())))